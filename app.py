@@ -1,18 +1,25 @@
-from fastapi import FastAPI, HTTPException, UploadFile, File, Request, Depends
+from fastapi import FastAPI, HTTPException, UploadFile, File, Request, Depends, BackgroundTasks
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import FileResponse
-from starlette.middleware.base import BaseHTTPMiddleware
-from starlette.requests import Request as StarletteRequest
-from starlette.responses import Response
-from sqlalchemy import create_engine, Column, Integer, String, Float, ForeignKey, Boolean, or_, and_, func, Table, DateTime, UniqueConstraint
+from fastapi.responses import FileResponse, RedirectResponse
+from fastapi.staticfiles import StaticFiles
+from sqlalchemy import create_engine, event, text, select, delete, exists, literal, bindparam, Column, Integer, String, Float, ForeignKey, Boolean, or_, and_, false, func, Table, DateTime, UniqueConstraint, Index, Computed, inspect
 from sqlalchemy.ext.declarative import declarative_base
-from sqlalchemy.orm import sessionmaker, relationship
+from sqlalchemy.orm import sessionmaker, relationship, aliased, Session
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from anyio import to_thread, open_file
 from pydantic import BaseModel
 from typing import List, Optional
+from concurrent.futures import Future, ThreadPoolExecutor
+import asyncio
+import functools
 import hashlib
+import hmac
 import secrets
 import re
 import random
+import time
 import os
 
 # Database configuration - supports both SQLite (local) and PostgreSQL (cloud)
@@ -22,62 +29,246 @@ DATABASE_URL = os.getenv("DATABASE_URL", "sqlite:///StitchMatch.db")
 if DATABASE_URL.startswith("postgres://"):
     DATABASE_URL = DATABASE_URL.replace("postgres://", "postgresql://", 1)
 
+# Sync endpoints run on anyio's worker threadpool, which defaults to 40 threads; once
+# those are all busy every other request queues behind them. The Postgres pool is
+# sized to match so each of those threads can get a connection without waiting.
+THREADPOOL_SIZE = int(os.getenv("THREADPOOL_SIZE", "60"))
+DB_POOL_SIZE = 20
+# Background /patterns/ COUNT workers; a request thread keeps its own connection while it
+# waits on one, so the pool also has a connection for each of these
+PATTERN_COUNT_WORKERS = 8
+
 # Create PDF uploads directory if it doesn't exist
 PDF_UPLOADS_DIR = "pdf_uploads"
 os.makedirs(PDF_UPLOADS_DIR, exist_ok=True)
+# Uploads are streamed to disk in chunks of this size
+PDF_UPLOAD_CHUNK_SIZE = 1 << 20
 
 # Create engine with appropriate connect_args based on database type
 if DATABASE_URL.startswith("sqlite"):
-    engine = create_engine(DATABASE_URL, connect_args={"check_same_thread": False})
+    engine = create_engine(DATABASE_URL, connect_args={"check_same_thread": False}, pool_pre_ping=True, query_cache_size=1200)
+
+    # Tune every new SQLite connection: WAL lets readers run alongside a writer,
+    # and the cache/mmap settings keep hot pages in memory instead of re-reading them
+    @event.listens_for(engine, "connect")
+    def set_sqlite_pragmas(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        cursor.execute("PRAGMA journal_mode=WAL")
+        cursor.execute("PRAGMA synchronous=NORMAL")
+        cursor.execute("PRAGMA temp_store=MEMORY")
+        cursor.execute("PRAGMA cache_size=-65536")
+        cursor.execute("PRAGMA mmap_size=268435456")
+        # SQLite ignores foreign keys (and so ON DELETE CASCADE) unless asked per connection
+        cursor.execute("PRAGMA foreign_keys=ON")
+        cursor.close()
 else:
-    engine = create_engine(DATABASE_URL)
-SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+    # TCP keepalives stop Railway's proxy from silently dropping idle pooled connections;
+    # pre-ping and recycle replace connections that went stale across a database restart
+    engine = create_engine(
+        DATABASE_URL,
+        pool_size=DB_POOL_SIZE,
+        max_overflow=max(THREADPOOL_SIZE + PATTERN_COUNT_WORKERS - DB_POOL_SIZE, 0),
+        pool_timeout=30,
+        pool_pre_ping=True,
+        pool_recycle=1800,
+        # Send multi-row inserts as batched INSERT ... VALUES pages rather than one
+        # statement per row
+        executemany_mode="values_plus_batch",
+        executemany_values_page_size=500,
+        # Room for every distinct statement shape the endpoints emit, so none get
+        # evicted from the compiled-SQL cache and recompiled on each request
+        query_cache_size=1200,
+        connect_args={
+            "keepalives": 1,
+            "keepalives_idle": 30,
+            "keepalives_interval": 10,
+            "keepalives_count": 3
+        }
+    )
+SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine, expire_on_commit=False)
+
+# Request-scoped session dependency: the session is always closed (and any
+# uncommitted work rolled back) once the response is sent, even on errors
+def get_db():
+    db = SessionLocal()
+    try:
+        yield db
+    finally:
+        db.close()
+
 Base = declarative_base()
 
-# Create all tables
-Base.metadata.create_all(bind=engine)
+# Link prices that count as free (compared case-insensitively). HasLink_Link.is_free is
+# generated from this at write time so the free_only filters can use an index.
+FREE_LINK_PRICES = ('free', '0', '0.0', '$0.00', '0.0 gbp', '0.0 dkk', '0.0 usd')
+LINK_IS_FREE_SQL = "lower(price) IN (%s)" % ", ".join(f"'{price}'" for price in FREE_LINK_PRICES)
+
+# Additional indexes for better query performance. Table names are quoted so they
+# match the mixed-case tables SQLAlchemy creates on Postgres.
+INDEX_STATEMENTS = [text(statement) for statement in (
+    # Index for PatternSuggestsYarn lookups
+    'CREATE INDEX IF NOT EXISTS idx_pattern_suggests_yarn_pattern ON "PatternSuggestsYarn"(pattern_id)',
+    'CREATE INDEX IF NOT EXISTS idx_pattern_suggests_yarn_yarn ON "PatternSuggestsYarn"(yarn_id)',
+    
+    # Index for YarnType weight lookups
+    'CREATE INDEX IF NOT EXISTS idx_yarn_type_weight ON "YarnType"(weight)',
+    
+    # Case-insensitive name lookups for the reference tables
+    'CREATE INDEX IF NOT EXISTS idx_yarn_type_weight_lower ON "YarnType"(lower(weight))',
+    'CREATE INDEX IF NOT EXISTS idx_craft_type_name_lower ON "CraftType"(lower(name))',
+    'CREATE INDEX IF NOT EXISTS idx_project_type_name_lower ON "ProjectType"(lower(name))',
+    
+    # Index for OwnsYarn user lookups
+    'CREATE INDEX IF NOT EXISTS idx_owns_yarn_user ON "OwnsYarn"(user_id)',
+    'CREATE INDEX IF NOT EXISTS idx_owns_yarn_yarn ON "OwnsYarn"(yarn_id)',
+    
+    # Index for pattern relationships
+    'CREATE INDEX IF NOT EXISTS idx_requires_craft_type_pattern ON "RequiresCraftType"(pattern_id)',
+    'CREATE INDEX IF NOT EXISTS idx_suitable_for_pattern ON "SuitableFor"(pattern_id)',
+    'CREATE INDEX IF NOT EXISTS idx_has_link_pattern ON "HasLink_Link"(pattern_id)',
+    
+    # Reverse lookups for the project type and craft type filters; the primary keys
+    # lead with pattern_id so they can't serve these
+    'CREATE INDEX IF NOT EXISTS idx_suitable_for_project_type ON "SuitableFor"(project_type_id, pattern_id)',
+    'CREATE INDEX IF NOT EXISTS idx_requires_craft_type_craft ON "RequiresCraftType"(craft_type_id)',
+    
+    # Index for OwnsPattern user lookups
+    'CREATE INDEX IF NOT EXISTS idx_owns_pattern_user ON "OwnsPattern"(user_id)',
+    'CREATE INDEX IF NOT EXISTS idx_owns_pattern_pattern ON "OwnsPattern"(pattern_id)',
+    
+    # Index for OwnsTool tool lookups (whether anyone else still owns a tool); the
+    # (user_id, tool_id) primary key already covers per-user lookups
+    'CREATE INDEX IF NOT EXISTS idx_owns_tool_tool ON "OwnsTool"(tool_id)',
+    
+    # Pattern de-duplication by (name, designer); fails harmlessly (and is logged) if
+    # an existing database still holds duplicates
+    'CREATE UNIQUE INDEX IF NOT EXISTS uq_pattern_name_designer ON "Pattern"(name, designer)',
+    
+    # Partial index over the patterns with a free link, for the free_only filters
+    'CREATE INDEX IF NOT EXISTS idx_has_link_free ON "HasLink_Link"(pattern_id) WHERE is_free',
+)]
+
+# Trigram indexes so the name/designer ILIKE '%...%' searches don't scan every pattern.
+# Postgres only; creating the extension needs a role that's allowed to, otherwise these
+# are logged and skipped like any other failed index.
+POSTGRES_INDEX_STATEMENTS = [text(statement) for statement in (
+    'CREATE EXTENSION IF NOT EXISTS pg_trgm',
+    'CREATE INDEX IF NOT EXISTS idx_pattern_name_trgm ON "Pattern" USING gin (name gin_trgm_ops)',
+    'CREATE INDEX IF NOT EXISTS idx_pattern_designer_trgm ON "Pattern" USING gin (designer gin_trgm_ops)',
+)]
+
+NON_CASCADING_PATTERN_FKS = text("""
+    SELECT con.conname, rel.relname, att.attname
+    FROM pg_constraint con
+    JOIN pg_class rel ON rel.oid = con.conrelid
+    JOIN pg_attribute att ON att.attrelid = con.conrelid AND att.attnum = con.conkey[1]
+    WHERE con.contype = 'f'
+      AND con.confrelid = '"Pattern"'::regclass
+      AND con.confdeltype <> 'c'
+""")
+
+def add_link_is_free_column():
+    """Add the generated HasLink_Link.is_free column to tables created before it existed"""
+    try:
+        if any(column["name"] == "is_free" for column in inspect(engine).get_columns("HasLink_Link")):
+            return
+        # SQLite can only add VIRTUAL generated columns to an existing table
+        storage = "VIRTUAL" if DATABASE_URL.startswith("sqlite") else "STORED"
+        with engine.begin() as conn:
+            conn.execute(text(
+                f'ALTER TABLE "HasLink_Link" ADD COLUMN is_free BOOLEAN '
+                f'GENERATED ALWAYS AS ({LINK_IS_FREE_SQL}) {storage}'
+            ))
+        print("Added HasLink_Link.is_free column")
+    except Exception as e:
+        print(f"Error adding HasLink_Link.is_free column: {e}")
 
-# Create additional indexes for better performance
 def create_indexes():
     """Create additional indexes for better query performance"""
+    add_link_is_free_column()
+    statements = INDEX_STATEMENTS
+    if not DATABASE_URL.startswith("sqlite"):
+        statements = INDEX_STATEMENTS + POSTGRES_INDEX_STATEMENTS
     db = SessionLocal()
+    failed = 0
     try:
-        # Index for PatternSuggestsYarn lookups
-        db.execute("CREATE INDEX IF NOT EXISTS idx_pattern_suggests_yarn_pattern ON PatternSuggestsYarn(pattern_id)")
-        db.execute("CREATE INDEX IF NOT EXISTS idx_pattern_suggests_yarn_yarn ON PatternSuggestsYarn(yarn_id)")
-        
-        # Index for YarnType weight lookups
-        db.execute("CREATE INDEX IF NOT EXISTS idx_yarn_type_weight ON YarnType(weight)")
-        
-        # Index for OwnsYarn user lookups
-        db.execute("CREATE INDEX IF NOT EXISTS idx_owns_yarn_user ON OwnsYarn(user_id)")
-        db.execute("CREATE INDEX IF NOT EXISTS idx_owns_yarn_yarn ON OwnsYarn(yarn_id)")
-        
-        # Index for pattern relationships
-        db.execute("CREATE INDEX IF NOT EXISTS idx_requires_craft_type_pattern ON RequiresCraftType(pattern_id)")
-        db.execute("CREATE INDEX IF NOT EXISTS idx_suitable_for_pattern ON SuitableFor(pattern_id)")
-        db.execute("CREATE INDEX IF NOT EXISTS idx_has_link_pattern ON HasLink_Link(pattern_id)")
-        
-        # Index for OwnsPattern user lookups
-        db.execute("CREATE INDEX IF NOT EXISTS idx_owns_pattern_user ON OwnsPattern(user_id)")
-        db.execute("CREATE INDEX IF NOT EXISTS idx_owns_pattern_pattern ON OwnsPattern(pattern_id)")
-        
-        db.commit()
-        print("Database indexes created successfully")
-    except Exception as e:
-        print(f"Error creating indexes: {e}")
-        db.rollback()
+        # Commit each index separately so one failure (e.g. a missing table)
+        # doesn't abort the rest of the transaction on Postgres
+        for statement in statements:
+            try:
+                db.execute(statement)
+                db.commit()
+            except Exception as e:
+                db.rollback()
+                failed += 1
+                print(f"Error creating index: {e}")
+        if not failed:
+            print("Database indexes created successfully")
     finally:
         db.close()
+    
+    if DATABASE_URL.startswith("sqlite"):
+        return
+    # Tables created before the pattern foreign keys were declared ON DELETE CASCADE keep
+    # their old constraints; recreate any of those that don't cascade yet
+    try:
+        with engine.begin() as conn:
+            for constraint, table, column in conn.execute(NON_CASCADING_PATTERN_FKS):
+                conn.execute(text(
+                    f'ALTER TABLE "{table}" DROP CONSTRAINT "{constraint}", '
+                    f'ADD CONSTRAINT "{constraint}" FOREIGN KEY ("{column}") '
+                    f'REFERENCES "Pattern"(pattern_id) ON DELETE CASCADE'
+                ))
+                print(f"Foreign key {constraint} on {table} now cascades pattern deletes")
+    except Exception as e:
+        print(f"Error updating pattern foreign keys: {e}")
 
-# Create indexes on startup
-create_indexes()
+# Arbitrary app-wide key for the Postgres advisory lock that serializes startup setup
+SCHEMA_SETUP_LOCK_KEY = 7_861_201
 
-app = FastAPI()
+TOOL_SEQUENCE_RESYNC = text(
+    "SELECT setval(pg_get_serial_sequence('\"Tool\"', 'tool_id'), "
+    "(SELECT COALESCE(MAX(tool_id), 0) + 1 FROM \"Tool\"), false)"
+)
 
-# --- Auto-restore PDFs from cloud storage on startup ---
-@app.on_event("startup")
-def restore_pdfs_on_startup():
+def setup_database() -> bool:
+    """Create missing tables and indexes and resync the Tool id sequence.
+
+    On Postgres only the worker that wins the advisory lock does the work; other workers
+    booting at the same time skip it instead of queueing on the same catalog locks.
+    Returns whether this worker ran the setup.
+    """
+    if DATABASE_URL.startswith("sqlite"):
+        # SQLite can't autoincrement one column of a composite primary key
+        HasLink_Link.__table__.c.link_id.autoincrement = False
+        Base.metadata.create_all(bind=engine)
+        create_indexes()
+        return True
+    
+    with engine.connect() as lock_conn:
+        got_lock = lock_conn.execute(
+            text("SELECT pg_try_advisory_lock(:key)"), {"key": SCHEMA_SETUP_LOCK_KEY}
+        ).scalar()
+        lock_conn.commit()
+        if not got_lock:
+            print("[STARTUP] Startup setup is running in another worker, skipping")
+            return False
+        try:
+            Base.metadata.create_all(bind=engine)
+            create_indexes()
+            try:
+                # Tools inserted with explicit ids can leave the sequence behind MAX(tool_id)
+                lock_conn.execute(TOOL_SEQUENCE_RESYNC)
+                lock_conn.commit()
+            except Exception as e:
+                lock_conn.rollback()
+                print(f"[STARTUP] Could not reset tool sequence: {e}")
+        finally:
+            lock_conn.execute(text("SELECT pg_advisory_unlock(:key)"), {"key": SCHEMA_SETUP_LOCK_KEY})
+            lock_conn.commit()
+    return True
+
+def restore_pdfs_from_cloud():
     try:
         from cloud_storage import CloudStorage
         storage = CloudStorage()
@@ -86,67 +277,40 @@ def restore_pdfs_on_startup():
     except Exception as e:
         print(f"[STARTUP] Failed to restore PDFs from cloud storage: {e}")
 
-# --- Fix User table sequence on startup ---
-@app.on_event("startup")
-def fix_user_sequence():
+def backup_pdf_to_cloud(pattern_id: int, filename: str, file_path: str):
     try:
-        if not DATABASE_URL.startswith("sqlite"):
-            from sqlalchemy import text
-            with engine.connect() as conn:
-                # Get the current maximum user_id
-                result = conn.execute(text("SELECT MAX(user_id) FROM \"User\""))
-                max_id = result.scalar()
-                
-                if max_id is None:
-                    max_id = 0
-                
-                print(f"[STARTUP] Current maximum user_id: {max_id}")
-                
-                # Reset the sequence to start after the maximum ID
-                conn.execute(text(f"SELECT setval('\"User_user_id_seq\"', {max_id + 1}, false)"))
-                conn.commit()
-                
-                print(f"[STARTUP] User sequence reset to start from: {max_id + 1}")
-    except Exception as e:
-        print(f"[STARTUP] Failed to fix user sequence: {e}")
+        from cloud_storage import CloudStorage
+        storage = CloudStorage()
+        storage.backup_pdf(pattern_id, filename, file_path)
+    except Exception as cloud_error:
+        print(f"Warning: Failed to backup PDF to cloud storage: {cloud_error}")
+
+app = FastAPI()
 
+# Keeps a reference to background startup work so it isn't garbage collected mid-run
+startup_tasks = set()
+
+# --- Single startup hook: threadpool, schema, sequences, then PDF restore in the background ---
 @app.on_event("startup")
-def fix_tool_sequence():
+async def startup():
+    # Raise the threadpool limit for sync endpoints
+    to_thread.current_default_thread_limiter().total_tokens = THREADPOOL_SIZE
+    
     try:
-        if not DATABASE_URL.startswith("sqlite"):
-            from sqlalchemy import text
-            with engine.connect() as conn:
-                # Get the current maximum tool_id
-                result = conn.execute(text("SELECT MAX(tool_id) FROM \"Tool\""))
-                max_id = result.scalar()
-                
-                if max_id is None:
-                    max_id = 0
-                
-                print(f"[STARTUP] Current maximum tool_id: {max_id}")
-                
-                # Reset the sequence to start after the maximum ID
-                # Note: sequence name might be different, check your PostgreSQL schema
-                try:
-                    conn.execute(text(f"SELECT setval('\"Tool_tool_id_seq\"', {max_id + 1}, false)"))
-                    conn.commit()
-                    print(f"[STARTUP] Tool sequence reset to start from: {max_id + 1}")
-                except Exception as seq_error:
-                    print(f"[STARTUP] Could not reset tool sequence: {seq_error}")
-                    # Try alternative sequence name
-                    try:
-                        conn.execute(text(f"SELECT setval('tool_tool_id_seq', {max_id + 1}, false)"))
-                        conn.commit()
-                        print(f"[STARTUP] Tool sequence reset to start from: {max_id + 1}")
-                    except Exception as seq_error2:
-                        print(f"[STARTUP] Could not reset tool sequence (alt name): {seq_error2}")
+        ran_setup = await to_thread.run_sync(setup_database)
     except Exception as e:
-        print(f"[STARTUP] Failed to fix tool sequence: {e}")
+        print(f"[STARTUP] Failed to set up database: {e}")
+        ran_setup = True
+    
+    # Only the worker that ran setup restores PDFs, and it doesn't hold up serving requests
+    if ran_setup:
+        task = asyncio.create_task(to_thread.run_sync(restore_pdfs_from_cloud))
+        startup_tasks.add(task)
+        task.add_done_callback(startup_tasks.discard)
 
 # Debug endpoint to check tool creation issues
 @app.get("/debug/tools")
-def debug_tools():
-    db = SessionLocal()
+def debug_tools(db: Session = Depends(get_db)):
     try:
         # Get all tools
         tools = db.query(Tool).all()
@@ -162,24 +326,20 @@ def debug_tools():
             })
         
         # Also check if the table exists and has proper structure
-        from sqlalchemy import inspect
         inspector = inspect(engine)
         columns = inspector.get_columns('Tool')
         
-        db.close()
         return {
             "tools": result,
             "total_tools": len(result),
             "table_columns": columns
         }
     except Exception as e:
-        db.close()
         return {"error": str(e)}
 
 @app.get("/debug/tool-duplicates")
-def debug_tool_duplicates():
+def debug_tool_duplicates(db: Session = Depends(get_db)):
     """Check for potential duplicate tools"""
-    db = SessionLocal()
     try:
         # Find tools with same type+size combinations
         from sqlalchemy import func
@@ -204,13 +364,11 @@ def debug_tool_duplicates():
                 "tool_ids": [t.tool_id for t in tools]
             })
         
-        db.close()
         return {
             "duplicates_found": len(result),
             "duplicate_groups": result
         }
     except Exception as e:
-        db.close()
         return {"error": str(e)}
 
 
@@ -263,14 +421,39 @@ def cleanup_duplicate_tools():
 
 # Removed HTTP to HTTPS redirection middleware - Railway handles this automatically
 
-# Custom middleware to add cache-busting headers
-class CacheControlMiddleware(BaseHTTPMiddleware):
-    async def dispatch(self, request: StarletteRequest, call_next):
-        response = await call_next(request)
-        response.headers["Cache-Control"] = "no-cache, no-store, must-revalidate"
-        response.headers["Pragma"] = "no-cache"
-        response.headers["Expires"] = "0"
-        return response
+# Custom middleware to add cache-busting headers to every response that doesn't set its
+# own Cache-Control. Written as plain ASGI rather than BaseHTTPMiddleware so it only
+# rewrites the response-start message, without the extra task and response stream
+# BaseHTTPMiddleware wraps around every request
+class CacheControlMiddleware:
+    NO_CACHE_HEADERS = [
+        (b"cache-control", b"no-cache, no-store, must-revalidate"),
+        (b"pragma", b"no-cache"),
+        (b"expires", b"0"),
+    ]
+    NO_CACHE_HEADER_NAMES = {name for name, _ in NO_CACHE_HEADERS}
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        async def send_with_cache_headers(message):
+            if message["type"] == "http.response.start":
+                headers = message.get("headers", [])
+                if not any(name.lower() == b"cache-control" for name, _ in headers):
+                    headers = [
+                        (name, value) for name, value in headers
+                        if name.lower() not in self.NO_CACHE_HEADER_NAMES
+                    ]
+                    headers.extend(self.NO_CACHE_HEADERS)
+                    message["headers"] = headers
+            await send(message)
+
+        await self.app(scope, receive, send_with_cache_headers)
 
 # Add CORS middleware
 app.add_middleware(
@@ -279,13 +462,11 @@ app.add_middleware(
         "https://stitch-match.vercel.app",
         "https://stitch-match-git-main-hollyschr.vercel.app",
         "https://stitch-match-hollyschr.vercel.app",
-        "http://localhost:3000",
-        "http://localhost:3001", 
-        "http://localhost:3002",
-        "http://localhost:3003",
-        "http://192.168.1.95:3003",
-        "*"  # Allow all origins for debugging
+        "http://192.168.1.95:3003"
     ],
+    # Vercel preview deployments and any local dev port; compiled once by CORSMiddleware.
+    # ("*" is not used: browsers reject a wildcard origin on credentialed requests)
+    allow_origin_regex=r"https://stitch-match(-[a-z0-9-]+)?\.vercel\.app|http://localhost:\d+",
     allow_credentials=True,
     allow_methods=["GET", "POST", "PUT", "DELETE", "OPTIONS"],
     allow_headers=["*"],
@@ -296,6 +477,18 @@ app.add_middleware(
 # Add cache control middleware
 app.add_middleware(CacheControlMiddleware)
 
+# Uploaded PDFs get a fresh random filename on every upload, so the file behind a name
+# never changes and browsers may cache it for good
+class ImmutableStaticFiles(StaticFiles):
+    async def get_response(self, path, scope):
+        response = await super().get_response(path, scope)
+        response.headers["Cache-Control"] = "public, max-age=31536000, immutable"
+        return response
+
+# Local PDFs served straight from disk (with ETag/Last-Modified revalidation), no database
+PDF_STATIC_PATH = "/pdf-static"
+app.mount(PDF_STATIC_PATH, ImmutableStaticFiles(directory=PDF_UPLOADS_DIR), name="pdf-static")
+
 # SQLAlchemy Models
 class User(Base):
     __tablename__ = "User"
@@ -312,6 +505,11 @@ class Pattern(Base):
     designer = Column(String)
     image = Column(String)
     google_drive_file_id = Column(String, nullable=True)  # Store Google Drive file ID
+    
+    # One row per (name, designer) so concurrent imports can't create duplicates
+    __table_args__ = (
+        Index('uq_pattern_name_designer', 'name', 'designer', unique=True),
+    )
 
 class ProjectType(Base):
     __tablename__ = "ProjectType"
@@ -345,7 +543,7 @@ class Tool(Base):
 class OwnsPattern(Base):
     __tablename__ = "OwnsPattern"
     user_id = Column(Integer, ForeignKey("User.user_id"), primary_key=True)
-    pattern_id = Column(Integer, ForeignKey("Pattern.pattern_id"), primary_key=True)
+    pattern_id = Column(Integer, ForeignKey("Pattern.pattern_id", ondelete="CASCADE"), primary_key=True)
 
 class OwnsYarn(Base):
     __tablename__ = "OwnsYarn"
@@ -361,17 +559,17 @@ class OwnsTool(Base):
 
 class RequiresCraftType(Base):
     __tablename__ = "RequiresCraftType"
-    pattern_id = Column(Integer, ForeignKey("Pattern.pattern_id"), primary_key=True)
+    pattern_id = Column(Integer, ForeignKey("Pattern.pattern_id", ondelete="CASCADE"), primary_key=True)
     craft_type_id = Column(Integer, ForeignKey("CraftType.craft_type_id"))
 
 class SuitableFor(Base):
     __tablename__ = "SuitableFor"
-    pattern_id = Column(Integer, ForeignKey("Pattern.pattern_id"), primary_key=True)
+    pattern_id = Column(Integer, ForeignKey("Pattern.pattern_id", ondelete="CASCADE"), primary_key=True)
     project_type_id = Column(Integer, ForeignKey("ProjectType.project_type_id"), primary_key=True)
 
 class PatternSuggestsYarn(Base):
     __tablename__ = "PatternSuggestsYarn"
-    pattern_id = Column(Integer, ForeignKey("Pattern.pattern_id"), primary_key=True)
+    pattern_id = Column(Integer, ForeignKey("Pattern.pattern_id", ondelete="CASCADE"), primary_key=True)
     yarn_id = Column(String, ForeignKey("YarnType.yarn_id"), primary_key=True)
     yardage_min = Column(Float, nullable=True)
     yardage_max = Column(Float, nullable=True)
@@ -380,27 +578,55 @@ class PatternSuggestsYarn(Base):
 
 class PatternRequiresTool(Base):
     __tablename__ = "PatternRequiresTool"
-    pattern_id = Column(Integer, ForeignKey("Pattern.pattern_id"), primary_key=True)
+    pattern_id = Column(Integer, ForeignKey("Pattern.pattern_id", ondelete="CASCADE"), primary_key=True)
     tool_id = Column(Integer, ForeignKey("Tool.tool_id"), primary_key=True)
 
 class HasLink_Link(Base):
     __tablename__ = "HasLink_Link"
-    pattern_id = Column(Integer, ForeignKey("Pattern.pattern_id"), primary_key=True)
+    pattern_id = Column(Integer, ForeignKey("Pattern.pattern_id", ondelete="CASCADE"), primary_key=True)
     link_id = Column(Integer, primary_key=True, autoincrement=True)
     url = Column(String)
     source = Column(String)
     price = Column(String, nullable=True)
+    is_free = Column(Boolean, Computed(LINK_IS_FREE_SQL, persisted=True))
 
 class FavoritePattern(Base):
     __tablename__ = "FavoritePattern"
     user_id = Column(Integer, ForeignKey("User.user_id"), primary_key=True)
-    pattern_id = Column(Integer, ForeignKey("Pattern.pattern_id"), primary_key=True)
+    pattern_id = Column(Integer, ForeignKey("Pattern.pattern_id", ondelete="CASCADE"), primary_key=True)
 
 # WorkInProgress table
 class WorkInProgress(Base):
     __tablename__ = 'WorkInProgress'
     user_id = Column(Integer, ForeignKey('User.user_id'), primary_key=True)
-    pattern_id = Column(Integer, ForeignKey('Pattern.pattern_id'), primary_key=True)
+    pattern_id = Column(Integer, ForeignKey('Pattern.pattern_id', ondelete='CASCADE'), primary_key=True)
+
+# Every table with a foreign key to Pattern.pattern_id
+PATTERN_CHILD_TABLES = (
+    PatternSuggestsYarn, RequiresCraftType, SuitableFor, PatternRequiresTool,
+    HasLink_Link, OwnsPattern, FavoritePattern, WorkInProgress
+)
+
+# Whether the database's pattern foreign keys all cascade; None until first checked
+_pattern_deletes_cascade = None
+
+def pattern_deletes_cascade() -> bool:
+    """Whether deleting a Pattern row also deletes its child rows in the database.
+
+    Tables created before the pattern foreign keys were declared ON DELETE CASCADE keep
+    their old constraints: Postgres ones are fixed at startup, but SQLite can't alter
+    a constraint, so old local databases never cascade.
+    """
+    global _pattern_deletes_cascade
+    if _pattern_deletes_cascade is None:
+        inspector = inspect(engine)
+        _pattern_deletes_cascade = all(
+            (fk["options"].get("ondelete") or "").upper() == "CASCADE"
+            for table in PATTERN_CHILD_TABLES
+            for fk in inspector.get_foreign_keys(table.__tablename__)
+            if fk["referred_table"] == "Pattern"
+        )
+    return _pattern_deletes_cascade
 
 # Pydantic Schemas
 class UserCreate(BaseModel):
@@ -472,22 +698,286 @@ class PaginatedPatternResponse(BaseModel):
     pagination: dict
 
 # Helper functions
+# Passwords are stored as "pbkdf2_sha256$<iterations>$<salt>$<hash>"; accounts created
+# before the switch still hold a bare SHA-256 hex digest and are upgraded on login
+PASSWORD_HASH_ALGORITHM = "pbkdf2_sha256"
+PASSWORD_HASH_ITERATIONS = 600_000
+
 def hash_password(password: str) -> str:
-    return hashlib.sha256(password.encode()).hexdigest()
+    salt = secrets.token_hex(16)
+    digest = hashlib.pbkdf2_hmac("sha256", password.encode(), salt.encode(), PASSWORD_HASH_ITERATIONS).hex()
+    return f"{PASSWORD_HASH_ALGORITHM}${PASSWORD_HASH_ITERATIONS}${salt}${digest}"
+
+def verify_password(password: str, hashed: Optional[str]) -> bool:
+    if not hashed:
+        return False
+    if hashed.startswith(PASSWORD_HASH_ALGORITHM + "$"):
+        _, iterations, salt, digest = hashed.split("$", 3)
+        candidate = hashlib.pbkdf2_hmac("sha256", password.encode(), salt.encode(), int(iterations)).hex()
+    else:
+        # Legacy unsalted SHA-256 hash
+        candidate = hashlib.sha256(password.encode()).hexdigest()
+    return hmac.compare_digest(candidate, hashed.split("$")[-1])
+
+def password_needs_rehash(hashed: str) -> bool:
+    return not hashed.startswith(f"{PASSWORD_HASH_ALGORITHM}${PASSWORD_HASH_ITERATIONS}$")
+
+# Process-wide caches for the small reference tables. Craft types, project types and
+# yarn types are only ever added to, so a cached id never goes stale; misses (and
+# rows created later by another worker) always fall through to the database.
+_craft_type_ids = {}
+_project_type_ids = {}
+_yarn_ids_by_weight = {}
+
+def _cached_lookup(cache, db, id_column, name_column, name):
+    key = name.lower()
+    cached = cache.get(key)
+    if cached is None:
+        # lower() equality (rather than ILIKE) can use the lower(...) expression indexes
+        row = db.query(id_column).filter(func.lower(name_column) == key).first()
+        if row is None:
+            return None
+        cached = cache[key] = row[0]
+    return cached
+
+def get_craft_type_id(db, name: str) -> Optional[int]:
+    return _cached_lookup(_craft_type_ids, db, CraftType.craft_type_id, CraftType.name, name)
+
+def get_project_type_id(db, name: str) -> Optional[int]:
+    return _cached_lookup(_project_type_ids, db, ProjectType.project_type_id, ProjectType.name, name)
+
+def get_yarn_id_for_weight(db, weight: str) -> Optional[str]:
+    return _cached_lookup(_yarn_ids_by_weight, db, YarnType.yarn_id, YarnType.weight, weight)
+
+# Short-lived caches for /patterns/: whole response pages keyed by every query parameter,
+# and totals keyed by the active filters so paging through a listing doesn't re-run the
+# same COUNT for every page. Pattern writes clear both, but only in the process that
+# handled the write: with several uvicorn workers the others keep serving their cached
+# listings and totals until the TTL runs out. A new or edited pattern can therefore take
+# up to PATTERN_CACHE_TTL_SECONDS to show up everywhere, which is accepted for browsing.
+PATTERN_CACHE_TTL_SECONDS = 60
+PATTERN_COUNT_CACHE_SIZE = 512
+PATTERN_PAGE_CACHE_SIZE = 1024
+_pattern_counts = {}
+_pattern_pages = {}
+# Bumped by every invalidation, so a COUNT started before a pattern write doesn't cache
+# the old total once it finishes
+_pattern_cache_generation = 0
+# Uncached COUNTs run here, on their own connection, alongside the request's page query
+_pattern_count_executor = ThreadPoolExecutor(max_workers=PATTERN_COUNT_WORKERS, thread_name_prefix="pattern-count")
+
+def start_pattern_count(key, query) -> Future:
+    """Total for a /patterns/ query. A cached total comes back as an already finished
+    future; otherwise the COUNT is started in the background and the caller can fetch
+    its page in the meantime."""
+    cached = _pattern_counts.get(key)
+    if cached is not None and cached[0] > time.monotonic():
+        future = Future()
+        future.set_result(cached[1])
+        return future
+    return _pattern_count_executor.submit(_count_and_cache_patterns, key, query, _pattern_cache_generation)
+
+def _count_and_cache_patterns(key, query, generation) -> int:
+    with SessionLocal() as session:
+        # Ordering doesn't change the total, so drop it from the COUNT subquery
+        count = query.order_by(None).with_session(session).count()
+    if generation != _pattern_cache_generation:
+        return count  # Patterns changed while counting
+    if len(_pattern_counts) >= PATTERN_COUNT_CACHE_SIZE:
+        _pattern_counts.clear()
+    _pattern_counts[key] = (time.monotonic() + PATTERN_CACHE_TTL_SECONDS, count)
+    return count
+
+def get_cached_pattern_page(key) -> Optional["PaginatedPatternResponse"]:
+    cached = _pattern_pages.get(key)
+    if cached is not None and cached[0] > time.monotonic():
+        return cached[1]
+    return None
+
+def cache_pattern_page(key, response: "PaginatedPatternResponse", generation: int):
+    if generation != _pattern_cache_generation:
+        return  # Patterns changed while this page was being built
+    if len(_pattern_pages) >= PATTERN_PAGE_CACHE_SIZE:
+        _pattern_pages.clear()
+    _pattern_pages[key] = (time.monotonic() + PATTERN_CACHE_TTL_SECONDS, response)
+
+def invalidate_pattern_caches():
+    global _pattern_cache_generation
+    _pattern_cache_generation += 1
+    _pattern_counts.clear()
+    _pattern_pages.clear()
+
+def make_yarn_id(yarn: "YarnCreate") -> str:
+    """Stable yarn_id for a yarn: a hash of its name, brand, weight and fiber"""
+    return hashlib.sha256(f"{yarn.yarn_name}{yarn.brand}{yarn.weight}{yarn.fiber}".encode()).hexdigest()
+
+def add_tool_to_user(db, user_id: int, tool: "ToolCreate"):
+    """Add a tool to a user's collection, creating the tool if needed (not committed).
+
+    Returns (tool_id, created). Raises a 400 if the user already owns the tool.
+    """
+    # type+size is unique, so RETURNING only yields a row when this call created the tool;
+    # a concurrent request creating the same tool simply makes this a no-op
+    created = db.execute(
+        insert_or_ignore(Tool).values(type=tool.type, size=tool.size).returning(Tool.tool_id)
+    ).first()
+    if created is not None:
+        tool_id = created.tool_id
+    else:
+        tool_id = db.query(Tool.tool_id).filter(
+            Tool.type == tool.type,
+            Tool.size == tool.size
+        ).scalar()
+    
+    # Likewise no row back here means the user already owns this tool
+    owned = db.execute(
+        insert_or_ignore(OwnsTool).values(user_id=user_id, tool_id=tool_id).returning(OwnsTool.tool_id)
+    ).first()
+    if owned is None:
+        raise HTTPException(status_code=400, detail="You already own this tool")
+    return tool_id, created is not None
+
+def row_exists(db, *criteria) -> bool:
+    """Existence probe via SELECT EXISTS(...), without loading or tracking an ORM object"""
+    return db.query(exists().where(*criteria)).scalar()
+
+# Users are never deleted, so a user_id once seen to exist stays valid for the life of
+# the process; unknown ids always go back to the database
+_known_user_ids = set()
+
+def require_user(db, user_id: int):
+    """Raise a 404 unless the user exists"""
+    if user_id in _known_user_ids:
+        return
+    if not row_exists(db, User.user_id == user_id):
+        raise HTTPException(status_code=404, detail="User not found")
+    _known_user_ids.add(user_id)
+
+def insert_or_ignore(model):
+    """INSERT ... ON CONFLICT DO NOTHING for the configured database (Postgres or SQLite)"""
+    insert = pg_insert if engine.dialect.name == "postgresql" else sqlite_insert
+    return insert(model).on_conflict_do_nothing()
+
+def pattern_listing_query(db):
+    """Query returning one row per pattern along with its craft type, project type,
+    suggested yarn (weight and yardage/grams) and link.
+
+    A pattern can have several project types, yarn suggestions or links; the one with the
+    lowest id is used so a pattern always renders the same way.
+    """
+    suitable_for = aliased(SuitableFor)
+    suggests_yarn = aliased(PatternSuggestsYarn)
+    link = aliased(HasLink_Link)
+    first_project_type = select(func.min(suitable_for.project_type_id)).where(
+        suitable_for.pattern_id == Pattern.pattern_id
+    ).scalar_subquery()
+    first_yarn = select(func.min(suggests_yarn.yarn_id)).where(
+        suggests_yarn.pattern_id == Pattern.pattern_id
+    ).scalar_subquery()
+    first_link = select(func.min(link.link_id)).where(
+        link.pattern_id == Pattern.pattern_id
+    ).scalar_subquery()
+    
+    return db.query(
+        Pattern.pattern_id,
+        Pattern.name,
+        Pattern.designer,
+        Pattern.image,
+        Pattern.google_drive_file_id,
+        CraftType.name.label("craft_type"),
+        ProjectType.name.label("project_type"),
+        YarnType.weight.label("required_weight"),
+        PatternSuggestsYarn.yardage_min,
+        PatternSuggestsYarn.yardage_max,
+        PatternSuggestsYarn.grams_min,
+        PatternSuggestsYarn.grams_max,
+        HasLink_Link.url.label("pattern_url"),
+        HasLink_Link.price
+    ).select_from(Pattern).outerjoin(
+        RequiresCraftType, RequiresCraftType.pattern_id == Pattern.pattern_id
+    ).outerjoin(
+        CraftType, CraftType.craft_type_id == RequiresCraftType.craft_type_id
+    ).outerjoin(
+        SuitableFor, and_(SuitableFor.pattern_id == Pattern.pattern_id, SuitableFor.project_type_id == first_project_type)
+    ).outerjoin(
+        ProjectType, ProjectType.project_type_id == SuitableFor.project_type_id
+    ).outerjoin(
+        PatternSuggestsYarn, and_(PatternSuggestsYarn.pattern_id == Pattern.pattern_id, PatternSuggestsYarn.yarn_id == first_yarn)
+    ).outerjoin(
+        YarnType, YarnType.yarn_id == PatternSuggestsYarn.yarn_id
+    ).outerjoin(
+        HasLink_Link, and_(HasLink_Link.pattern_id == Pattern.pattern_id, HasLink_Link.link_id == first_link)
+    )
+
+def format_link_price(price_value: Optional[str]) -> Optional[str]:
+    """Display form of an imported pattern's HasLink_Link price"""
+    if price_value is None:
+        return None
+    if price_value.lower() == 'free' or price_value == '0' or price_value == '0.0':
+        return "Free"
+    # Keep the original price string as it may contain currency info
+    return price_value
+
+def pattern_response_from_row(row) -> PatternResponse:
+    """Build a PatternResponse from a pattern_listing_query() row.
+
+    Uses model_construct: the values come straight from typed columns, and FastAPI
+    validates the whole response against response_model once anyway.
+    """
+    return PatternResponse.model_construct(
+        pattern_id=row.pattern_id,
+        name=row.name,
+        designer=row.designer,
+        image=row.image if row.image is not None else "/placeholder.svg",
+        google_drive_file_id=row.google_drive_file_id,
+        yardage_min=row.yardage_min,
+        yardage_max=row.yardage_max,
+        grams_min=row.grams_min,
+        grams_max=row.grams_max,
+        project_type=row.project_type,
+        craft_type=row.craft_type,
+        # For generic yarn types, don't show "Unknown" as the weight
+        required_weight=None if row.required_weight == "Unknown" else row.required_weight,
+        # User-uploaded patterns have no link, so no URL or price
+        pattern_url=row.pattern_url,
+        price=format_link_price(row.price)
+    )
+
+USER_SEQUENCE_RESYNC = text(
+    "SELECT setval(pg_get_serial_sequence('\"User\"', 'user_id'), "
+    "(SELECT COALESCE(MAX(user_id), 0) + 1 FROM \"User\"), false)"
+)
 
-def verify_password(password: str, hashed: str) -> bool:
-    return hash_password(password) == hashed
+# Statements for the hottest per-user reads, built once at import; callers bind user_id
+USER_TOOLS = select(Tool.tool_id, Tool.type, Tool.size).join(
+    OwnsTool, OwnsTool.tool_id == Tool.tool_id
+).where(OwnsTool.user_id == bindparam("user_id"))
+
+USER_YARN = select(
+    YarnType.yarn_id,
+    YarnType.yarn_name,
+    YarnType.brand,
+    YarnType.weight,
+    YarnType.fiber,
+    OwnsYarn.yardage,
+    OwnsYarn.grams
+).join(OwnsYarn, OwnsYarn.yarn_id == YarnType.yarn_id).where(OwnsYarn.user_id == bindparam("user_id"))
+
+USER_STASH_YARDAGE_BY_WEIGHT = select(YarnType.weight, func.sum(OwnsYarn.yardage)).join(
+    OwnsYarn, OwnsYarn.yarn_id == YarnType.yarn_id
+).where(OwnsYarn.user_id == bindparam("user_id")).group_by(YarnType.weight).order_by(YarnType.weight)
+
+# Every weight some pattern asks for; stash matching is decided per weight, not per row
+PATTERN_REQUIRED_WEIGHTS = select(YarnType.weight).join(
+    PatternSuggestsYarn, PatternSuggestsYarn.yarn_id == YarnType.yarn_id
+).where(YarnType.weight.isnot(None)).distinct()
 
 # API Endpoints
 
 @app.post("/auth/register", response_model=UserResponse)
-def register_user(user: UserCreate):
-    db = SessionLocal()
-    
+def register_user(user: UserCreate, db: Session = Depends(get_db)):
     # Check if email already exists
-    existing_user = db.query(User).filter(User.email == user.email).first()
-    if existing_user:
-        db.close()
+    if row_exists(db, User.email == user.email):
         raise HTTPException(status_code=400, detail="Email already registered")
     
     # Create new user
@@ -499,9 +989,27 @@ def register_user(user: UserCreate):
         profile_photo=user.profile_photo
     )
     db.add(db_user)
-    db.commit()
+    try:
+        db.commit()
+    except IntegrityError:
+        db.rollback()
+        # A concurrent registration with the same email got in first
+        if row_exists(db, User.email == user.email):
+            raise HTTPException(status_code=400, detail="Email already registered")
+        if DATABASE_URL.startswith("sqlite"):
+            raise
+        # Rows imported with explicit ids can leave the user_id sequence behind;
+        # resync it once here instead of scanning MAX(user_id) on every startup
+        db.execute(USER_SEQUENCE_RESYNC)
+        db.add(db_user)
+        try:
+            db.commit()
+        except IntegrityError:
+            db.rollback()
+            if row_exists(db, User.email == user.email):
+                raise HTTPException(status_code=400, detail="Email already registered")
+            raise
     db.refresh(db_user)
-    db.close()
     
     return UserResponse(
         user_id=db_user.user_id,
@@ -511,21 +1019,25 @@ def register_user(user: UserCreate):
     )
 
 @app.post("/auth/login", response_model=UserResponse)
-def login_user(user: UserLogin):
-    db = SessionLocal()
-    
-    # Find user by email
-    db_user = db.query(User).filter(User.email == user.email).first()
+def login_user(user: UserLogin, db: Session = Depends(get_db)):
+    # Find user by email (plain columns, no ORM object needed)
+    db_user = db.execute(
+        select(User.user_id, User.name, User.email, User.password_hash, User.profile_photo)
+        .where(User.email == user.email)
+    ).first()
     if not db_user:
-        db.close()
         raise HTTPException(status_code=401, detail="Invalid email or password")
     
     # Verify password
     if not verify_password(user.password, db_user.password_hash):
-        db.close()
         raise HTTPException(status_code=401, detail="Invalid email or password")
     
-    db.close()
+    # Upgrade legacy SHA-256 (or weaker PBKDF2) hashes now that we know the password
+    if password_needs_rehash(db_user.password_hash):
+        db.query(User).filter(User.user_id == db_user.user_id).update(
+            {User.password_hash: hash_password(user.password)}, synchronize_session=False
+        )
+        db.commit()
     
     return UserResponse(
         user_id=db_user.user_id,
@@ -536,99 +1048,21 @@ def login_user(user: UserLogin):
 
 @app.get("/users/{user_id}/patterns", response_model=List[PatternResponse])
 @app.get("/users/{user_id}/patterns/", response_model=List[PatternResponse])
-def get_user_patterns(user_id: int):
-    db = SessionLocal()
-    
+def get_user_patterns(user_id: int, db: Session = Depends(get_db)):
     # Check if user exists
-    user = db.query(User).filter(User.user_id == user_id).first()
-    if not user:
-        db.close()
-        raise HTTPException(status_code=404, detail="User not found")
-    
-    # Get patterns owned by the user
-    user_patterns = db.query(Pattern).join(OwnsPattern).filter(OwnsPattern.user_id == user_id).all()
+    require_user(db, user_id)
     
-    # Build response with related data
-    result = []
-    for pattern in user_patterns:
-        # Get craft type
-        craft_type_result = db.query(CraftType.name).join(RequiresCraftType).filter(
-            RequiresCraftType.pattern_id == pattern.pattern_id
-        ).first()
-        craft_type_name = craft_type_result[0] if craft_type_result else None
-        
-        # Get project type
-        project_type_result = db.query(ProjectType.name).join(SuitableFor).filter(
-            SuitableFor.pattern_id == pattern.pattern_id
-        ).first()
-        project_type_name = project_type_result[0] if project_type_result else None
-        
-        # Get yarn weight and yardage/grams from PatternSuggestsYarn
-        yarn_result = db.query(YarnType.weight, PatternSuggestsYarn.yardage_min, PatternSuggestsYarn.yardage_max, PatternSuggestsYarn.grams_min, PatternSuggestsYarn.grams_max).join(PatternSuggestsYarn).filter(
-            PatternSuggestsYarn.pattern_id == pattern.pattern_id
-        ).first()
-        yarn_weight = yarn_result[0] if yarn_result else None
-        yardage_min = yarn_result[1] if yarn_result else None
-        yardage_max = yarn_result[2] if yarn_result else None
-        grams_min = yarn_result[3] if yarn_result else None
-        grams_max = yarn_result[4] if yarn_result else None
-        
-        # For generic yarn types, don't show "Unknown" as the weight
-        if yarn_weight == "Unknown":
-            yarn_weight = None
-        
-        # Get pattern link and price
-        link_result = db.query(HasLink_Link.url, HasLink_Link.price).filter(
-            HasLink_Link.pattern_id == pattern.pattern_id
-        ).first()
-        
-        # For imported patterns, use the HasLink_Link price and URL
-        if link_result:
-            pattern_url = link_result[0]  # Get the URL
-            # Format price for display
-            price_value = link_result[1]
-            if price_value is not None:
-                if price_value.lower() == 'free' or price_value == '0' or price_value == '0.0':
-                    price_display = "Free"
-                else:
-                    # Keep the original price string as it may contain currency info
-                    price_display = price_value
-            else:
-                price_display = None
-        else:
-            # This is a user-uploaded pattern, no price or URL
-            pattern_url = None
-            price_display = None
-        
-        result.append(PatternResponse(
-            pattern_id=pattern.pattern_id,
-            name=pattern.name,
-            designer=pattern.designer,
-            image=pattern.image if pattern.image is not None else "/placeholder.svg",
-            google_drive_file_id=pattern.google_drive_file_id,
-            yardage_min=yardage_min,
-            yardage_max=yardage_max,
-            grams_min=grams_min,
-            grams_max=grams_max,
-            project_type=project_type_name,
-            craft_type=craft_type_name,
-            required_weight=yarn_weight,
-            pattern_url=pattern_url,
-            price=price_display
-        ))
+    # Get patterns owned by the user, with all their related data, in a single query
+    rows = pattern_listing_query(db).join(
+        OwnsPattern, OwnsPattern.pattern_id == Pattern.pattern_id
+    ).filter(OwnsPattern.user_id == user_id).order_by(Pattern.pattern_id).all()
     
-    db.close()
-    return result
+    return [pattern_response_from_row(row) for row in rows]
 
 @app.post("/users/{user_id}/patterns/")
-def add_pattern(user_id: int, pattern: PatternCreate):
-    db = SessionLocal()
-    
+def add_pattern(user_id: int, pattern: PatternCreate, db: Session = Depends(get_db)):
     # Check if user exists
-    user = db.query(User).filter(User.user_id == user_id).first()
-    if not user:
-        db.close()
-        raise HTTPException(status_code=404, detail="User not found")
+    require_user(db, user_id)
     
     # Extract metadata fields from pattern data
     pattern_data = pattern.dict()
@@ -642,145 +1076,98 @@ def add_pattern(user_id: int, pattern: PatternCreate):
         'required_weight': pattern_data.pop('required_weight', None),
     }
     
-    # Check if pattern already exists (by name and designer)
-    existing_pattern = db.query(Pattern).filter(
+    # Create the pattern (only core fields) unless one with the same name and designer
+    # already exists. The NOT EXISTS guard and the unique index make this a single
+    # round trip for new patterns; only an existing pattern needs the follow-up SELECT.
+    same_pattern = and_(
         Pattern.name == pattern_data['name'],
         Pattern.designer == pattern_data['designer']
-    ).first()
-    
-    if existing_pattern:
-        # Pattern already exists, use existing pattern_id
-        pattern_id = existing_pattern.pattern_id
-    else:
-        # Create new pattern (only core fields)
-        db_pattern = Pattern(**pattern_data)
-        db.add(db_pattern)
-        db.commit()
-        db.refresh(db_pattern)
-        pattern_id = db_pattern.pattern_id
+    )
+    columns = list(pattern_data)
+    new_pattern = select(
+        *(literal(pattern_data[column], Pattern.__table__.c[column].type) for column in columns)
+    ).where(~exists().where(same_pattern))
+    pattern_id = db.execute(
+        insert_or_ignore(Pattern).from_select(columns, new_pattern).returning(Pattern.pattern_id)
+    ).scalar()
+    
+    if pattern_id is None:
+        # Pattern already exists, use existing pattern_id (the oldest, if a database that
+        # predates the unique index still holds duplicates)
+        pattern_id = db.query(Pattern.pattern_id).filter(same_pattern).order_by(Pattern.pattern_id).limit(1).scalar()
     
     # Insert metadata into normalized tables
     
     # 1. Handle craft type
     if metadata_fields['craft_type']:
-        craft_type_obj = db.query(CraftType).filter(
-            CraftType.name.ilike(metadata_fields['craft_type'])
-        ).first()
-        if craft_type_obj:
-            # Only add a craft type if the pattern does not already have any craft type
-            existing_craft_type = db.query(RequiresCraftType).filter(
-                RequiresCraftType.pattern_id == pattern_id
-            ).first()
-            if not existing_craft_type:
-                db_requires_craft = RequiresCraftType(
-                    pattern_id=pattern_id,
-                    craft_type_id=craft_type_obj.craft_type_id
-                )
-                db.add(db_requires_craft)
+        craft_type_id = get_craft_type_id(db, metadata_fields['craft_type'])
+        if craft_type_id:
+            # RequiresCraftType is keyed on pattern_id alone, so this is a no-op if the
+            # pattern already has a craft type
+            db.execute(insert_or_ignore(RequiresCraftType).values(
+                pattern_id=pattern_id,
+                craft_type_id=craft_type_id
+            ))
 
     # 2. Handle project type
     if metadata_fields['project_type']:
-        project_type_obj = db.query(ProjectType).filter(
-            ProjectType.name.ilike(metadata_fields['project_type'])
-        ).first()
-        if project_type_obj:
-            # Check if project type relationship already exists
-            existing_project_type = db.query(SuitableFor).filter(
-                SuitableFor.pattern_id == pattern_id,
-                SuitableFor.project_type_id == project_type_obj.project_type_id
-            ).first()
-            if not existing_project_type:
-                db_suitable_for = SuitableFor(
-                    pattern_id=pattern_id,
-                    project_type_id=project_type_obj.project_type_id
-                )
-                db.add(db_suitable_for)
+        project_type_id = get_project_type_id(db, metadata_fields['project_type'])
+        if project_type_id:
+            db.execute(insert_or_ignore(SuitableFor).values(
+                pattern_id=pattern_id,
+                project_type_id=project_type_id
+            ))
 
     # 3. Handle yarn weight and yardage/grams
+    yarn_id = None
     if metadata_fields['required_weight']:
-        yarn_type_obj = db.query(YarnType).filter(
-            YarnType.weight.ilike(metadata_fields['required_weight'])
-        ).first()
-        if not yarn_type_obj:
+        yarn_id = get_yarn_id_for_weight(db, metadata_fields['required_weight'])
+        if not yarn_id:
             # Create a new YarnType if it doesn't exist
-            yarn_type_obj = YarnType(
-                yarn_id=f"{metadata_fields['required_weight']}_generic_{pattern_id}",
+            yarn_id = f"{metadata_fields['required_weight']}_generic_{pattern_id}"
+            db.execute(insert_or_ignore(YarnType).values(
+                yarn_id=yarn_id,
                 yarn_name="Generic Yarn",
                 brand="Unknown",
                 weight=metadata_fields['required_weight'],
                 fiber="Unknown"
-            )
-            db.add(yarn_type_obj)
-        # Only add PatternSuggestsYarn if it doesn't already exist
-        existing_psy = db.query(PatternSuggestsYarn).filter(
-            PatternSuggestsYarn.pattern_id == pattern_id,
-            PatternSuggestsYarn.yarn_id == yarn_type_obj.yarn_id
-        ).first()
-        if not existing_psy:
-            db_pattern_suggests_yarn = PatternSuggestsYarn(
-                pattern_id=pattern_id,
-                yarn_id=yarn_type_obj.yarn_id,
-                yardage_min=metadata_fields['yardage_min'],
-                yardage_max=metadata_fields['yardage_max'],
-                grams_min=metadata_fields['grams_min'],
-                grams_max=metadata_fields['grams_max']
-            )
-            db.add(db_pattern_suggests_yarn)
+            ))
     # If no yarn weight specified but yardage/grams are provided, create a generic yarn type
     elif metadata_fields['yardage_min'] or metadata_fields['yardage_max'] or metadata_fields['grams_min'] or metadata_fields['grams_max']:
         # Create a generic yarn type for patterns without specific weight
-        generic_yarn_id = f"generic_{pattern_id}"
-        generic_yarn = db.query(YarnType).filter(YarnType.yarn_id == generic_yarn_id).first()
-        if not generic_yarn:
-            generic_yarn = YarnType(
-                yarn_id=generic_yarn_id,
-                yarn_name="Generic Yarn",
-                brand="Unknown",
-                weight="Unknown",
-                fiber="Unknown"
-            )
-            db.add(generic_yarn)
-        existing_psy = db.query(PatternSuggestsYarn).filter(
-            PatternSuggestsYarn.pattern_id == pattern_id,
-            PatternSuggestsYarn.yarn_id == generic_yarn_id
-        ).first()
-        if not existing_psy:
-            db_pattern_suggests_yarn = PatternSuggestsYarn(
-                pattern_id=pattern_id,
-                yarn_id=generic_yarn_id,
-                yardage_min=metadata_fields['yardage_min'],
-                yardage_max=metadata_fields['yardage_max'],
-                grams_min=metadata_fields['grams_min'],
-                grams_max=metadata_fields['grams_max']
-            )
-            db.add(db_pattern_suggests_yarn)
+        yarn_id = f"generic_{pattern_id}"
+        db.execute(insert_or_ignore(YarnType).values(
+            yarn_id=yarn_id,
+            yarn_name="Generic Yarn",
+            brand="Unknown",
+            weight="Unknown",
+            fiber="Unknown"
+        ))
+    if yarn_id:
+        db.execute(insert_or_ignore(PatternSuggestsYarn).values(
+            pattern_id=pattern_id,
+            yarn_id=yarn_id,
+            yardage_min=metadata_fields['yardage_min'],
+            yardage_max=metadata_fields['yardage_max'],
+            grams_min=metadata_fields['grams_min'],
+            grams_max=metadata_fields['grams_max']
+        ))
     
     # 4. Price handling is not needed for user-uploaded patterns since they're already owned
     
-    # Link pattern to user (check if ownership already exists)
-    existing_ownership = db.query(OwnsPattern).filter(
-        OwnsPattern.user_id == user_id,
-        OwnsPattern.pattern_id == pattern_id
-    ).first()
-    if not existing_ownership:
-        db_owns = OwnsPattern(user_id=user_id, pattern_id=pattern_id)
-        db.add(db_owns)
+    # Link pattern to user (no-op if the ownership already exists)
+    db.execute(insert_or_ignore(OwnsPattern).values(user_id=user_id, pattern_id=pattern_id))
     
     db.commit()
-    db.close()
+    invalidate_pattern_caches()
     
     return {"pattern_id": pattern_id}
 
 @app.put("/users/{user_id}/patterns/{pattern_id}/")
-def update_user_pattern(user_id: int, pattern_id: int, pattern: PatternCreate):
+def update_user_pattern(user_id: int, pattern_id: int, pattern: PatternCreate, db: Session = Depends(get_db)):
     """Update an existing user pattern"""
-    db = SessionLocal()
-    
     # Check if user exists
-    user = db.query(User).filter(User.user_id == user_id).first()
-    if not user:
-        db.close()
-        raise HTTPException(status_code=404, detail="User not found")
+    require_user(db, user_id)
     
     # Check if pattern exists and belongs to user
     existing_pattern = db.query(Pattern).join(OwnsPattern).filter(
@@ -789,7 +1176,6 @@ def update_user_pattern(user_id: int, pattern_id: int, pattern: PatternCreate):
     ).first()
     
     if not existing_pattern:
-        db.close()
         raise HTTPException(status_code=404, detail="Pattern not found or not owned by user")
     
     # Update basic pattern information
@@ -801,39 +1187,41 @@ def update_user_pattern(user_id: int, pattern_id: int, pattern: PatternCreate):
     
     # Update craft type
     if pattern.craft_type:
-        craft_type = db.query(CraftType).filter(CraftType.name == pattern.craft_type).first()
-        if not craft_type:
+        craft_type_id = get_craft_type_id(db, pattern.craft_type)
+        if not craft_type_id:
             craft_type = CraftType(name=pattern.craft_type)
             db.add(craft_type)
             db.flush()  # Get the ID
+            craft_type_id = craft_type.craft_type_id
         
         # Remove existing craft type associations
         db.query(RequiresCraftType).filter(RequiresCraftType.pattern_id == pattern_id).delete()
         
         # Add new craft type association
-        requires_craft = RequiresCraftType(pattern_id=pattern_id, craft_type_id=craft_type.craft_type_id)
+        requires_craft = RequiresCraftType(pattern_id=pattern_id, craft_type_id=craft_type_id)
         db.add(requires_craft)
     
     # Update project type
     if pattern.project_type:
-        project_type = db.query(ProjectType).filter(ProjectType.name == pattern.project_type).first()
-        if not project_type:
+        project_type_id = get_project_type_id(db, pattern.project_type)
+        if not project_type_id:
             project_type = ProjectType(name=pattern.project_type)
             db.add(project_type)
             db.flush()  # Get the ID
+            project_type_id = project_type.project_type_id
         
         # Remove existing project type associations
         db.query(SuitableFor).filter(SuitableFor.pattern_id == pattern_id).delete()
         
         # Add new project type association
-        suitable_for = SuitableFor(pattern_id=pattern_id, project_type_id=project_type.project_type_id)
+        suitable_for = SuitableFor(pattern_id=pattern_id, project_type_id=project_type_id)
         db.add(suitable_for)
     
     # Update yarn information
     if pattern.required_weight:
         # Find or create yarn type
-        yarn_type = db.query(YarnType).filter(YarnType.weight == pattern.required_weight).first()
-        if not yarn_type:
+        yarn_id = get_yarn_id_for_weight(db, pattern.required_weight)
+        if not yarn_id:
             # Create a generic yarn type for this weight
             yarn_type = YarnType(
                 yarn_id=f"generic_{pattern.required_weight.lower().replace(' ', '_')}",
@@ -844,6 +1232,7 @@ def update_user_pattern(user_id: int, pattern_id: int, pattern: PatternCreate):
             )
             db.add(yarn_type)
             db.flush()
+            yarn_id = yarn_type.yarn_id
         
         # Remove existing yarn associations
         db.query(PatternSuggestsYarn).filter(PatternSuggestsYarn.pattern_id == pattern_id).delete()
@@ -851,7 +1240,7 @@ def update_user_pattern(user_id: int, pattern_id: int, pattern: PatternCreate):
         # Add new yarn association
         pattern_suggests_yarn = PatternSuggestsYarn(
             pattern_id=pattern_id,
-            yarn_id=yarn_type.yarn_id,
+            yarn_id=yarn_id,
             yardage_min=pattern.yardage_min,
             yardage_max=pattern.yardage_max,
             grams_min=pattern.grams_min,
@@ -861,122 +1250,80 @@ def update_user_pattern(user_id: int, pattern_id: int, pattern: PatternCreate):
     
     try:
         db.commit()
-        db.close()
+        invalidate_pattern_caches()
         return {"message": "Pattern updated successfully"}
     except Exception as e:
         db.rollback()
-        db.close()
         raise HTTPException(status_code=500, detail=f"Failed to update pattern: {str(e)}")
 
 @app.delete("/users/{user_id}/patterns/{pattern_id}/")
-def delete_user_pattern(user_id: int, pattern_id: int):
-    db = SessionLocal()
-    
+def delete_user_pattern(user_id: int, pattern_id: int, db: Session = Depends(get_db)):
     # Check if user exists
-    user = db.query(User).filter(User.user_id == user_id).first()
-    if not user:
-        db.close()
-        raise HTTPException(status_code=404, detail="User not found")
+    require_user(db, user_id)
     
     # Check if pattern exists and is owned by the user
-    owns_pattern = db.query(OwnsPattern).filter(
+    owns_pattern = row_exists(
+        db,
         OwnsPattern.user_id == user_id,
         OwnsPattern.pattern_id == pattern_id
-    ).first()
+    )
     
     if not owns_pattern:
-        db.close()
         raise HTTPException(status_code=404, detail="Pattern not found in user's collection")
     
     # Check if this is an imported pattern (has HasLink_Link entry)
-    has_link = db.query(HasLink_Link).filter(
+    has_link = row_exists(
+        db,
         HasLink_Link.pattern_id == pattern_id
-    ).first()
+    )
     
     if has_link:
         # This is an imported pattern - users cannot delete imported patterns
-        db.close()
         raise HTTPException(status_code=403, detail="Cannot delete imported patterns. You can only remove them from your collection.")
     
-    # This is a user-uploaded pattern, delete the pattern and all related data
-    # First, delete related data in the correct order to avoid foreign key constraints
-    
-    # Delete yarn suggestions
-    db.query(PatternSuggestsYarn).filter(
-        PatternSuggestsYarn.pattern_id == pattern_id
-    ).delete()
-    
-    # Delete craft type requirements
-    db.query(RequiresCraftType).filter(
-        RequiresCraftType.pattern_id == pattern_id
-    ).delete()
-    
-    # Delete project type suitability
-    db.query(SuitableFor).filter(
-        SuitableFor.pattern_id == pattern_id
-    ).delete()
-    
-    # Delete tool requirements
-    db.query(PatternRequiresTool).filter(
-        PatternRequiresTool.pattern_id == pattern_id
-    ).delete()
-    
-    # Delete ownership relationships (for all users)
-    db.query(OwnsPattern).filter(
-        OwnsPattern.pattern_id == pattern_id
-    ).delete()
-    
-    # Finally, delete the pattern itself
-    pattern = db.query(Pattern).filter(Pattern.pattern_id == pattern_id).first()
-    if pattern:
-        db.delete(pattern)
-    
-    db.commit()
-    db.close()
+    # This is a user-uploaded pattern, delete the pattern; its yarn suggestions, craft/project
+    # types, tool requirements, ownership, favorites and WIP rows go with it via ON DELETE CASCADE,
+    # or are deleted here first where the schema predates the cascading foreign keys
+    try:
+        if not pattern_deletes_cascade():
+            for table in PATTERN_CHILD_TABLES:
+                db.execute(delete(table).where(table.pattern_id == pattern_id))
+        db.execute(delete(Pattern).where(Pattern.pattern_id == pattern_id))
+        db.commit()
+    except IntegrityError as e:
+        db.rollback()
+        raise HTTPException(status_code=409, detail=f"Pattern is still referenced and can't be deleted: {e.orig}")
+    invalidate_pattern_caches()
     return {"message": "User-uploaded pattern and all related data deleted"}
 
 @app.post("/users/{user_id}/yarn/")
-def add_yarn(user_id: int, yarn: YarnCreate):
-    db = SessionLocal()
+def add_yarn(user_id: int, yarn: YarnCreate, db: Session = Depends(get_db)):
     try:
         # Check if user exists
-        user = db.query(User).filter(User.user_id == user_id).first()
-        if not user:
-            raise HTTPException(status_code=404, detail="User not found")
+        require_user(db, user_id)
         
         # Generate a unique yarn_id (using hash of yarn details)
-        yarn_id = hashlib.sha256(f"{yarn.yarn_name}{yarn.brand}{yarn.weight}{yarn.fiber}".encode()).hexdigest()
+        yarn_id = make_yarn_id(yarn)
         
-        # Check if yarn type already exists
-        existing_yarn = db.query(YarnType).filter(YarnType.yarn_id == yarn_id).first()
-        if not existing_yarn:
-            db_yarn = YarnType(
-                yarn_id=yarn_id,
-                yarn_name=yarn.yarn_name,
-                brand=yarn.brand,
-                weight=yarn.weight,
-                fiber=yarn.fiber
-            )
-            db.add(db_yarn)
-            db.flush()  # Get the yarn_id without committing
-        
-        # Check if user already owns this yarn
-        existing_ownership = db.query(OwnsYarn).filter(
-            OwnsYarn.user_id == user_id,
-            OwnsYarn.yarn_id == yarn_id
-        ).first()
-        
-        if existing_ownership:
-            raise HTTPException(status_code=400, detail="User already owns this yarn")
+        # Create the yarn type unless it already exists
+        db.execute(insert_or_ignore(YarnType).values(
+            yarn_id=yarn_id,
+            yarn_name=yarn.yarn_name,
+            brand=yarn.brand,
+            weight=yarn.weight,
+            fiber=yarn.fiber
+        ))
         
-        # Add to user's stash
-        db_owns = OwnsYarn(
+        # Add to user's stash; no row back means the user already owns this yarn
+        added = db.execute(insert_or_ignore(OwnsYarn).values(
             user_id=user_id,
             yarn_id=yarn_id,
             yardage=yarn.yardage,
             grams=yarn.grams
-        )
-        db.add(db_owns)
+        ).returning(OwnsYarn.yarn_id)).first()
+        
+        if added is None:
+            raise HTTPException(status_code=400, detail="User already owns this yarn")
         
         # Commit all operations together
         db.commit()
@@ -988,21 +1335,58 @@ def add_yarn(user_id: int, yarn: YarnCreate):
     except Exception as e:
         db.rollback()
         raise HTTPException(status_code=500, detail=f"Error adding yarn: {str(e)}")
-    finally:
-        db.close()
+
+@app.post("/users/{user_id}/yarn/batch")
+def add_yarn_batch(user_id: int, yarns: List[YarnCreate], db: Session = Depends(get_db)):
+    """Add several yarns to a user's stash at once; yarns already in the stash are skipped"""
+    try:
+        # Check if user exists
+        require_user(db, user_id)
+        
+        # One entry per distinct yarn (the first one wins if a yarn is listed twice)
+        yarns_by_id = {}
+        for yarn in yarns:
+            yarns_by_id.setdefault(make_yarn_id(yarn), yarn)
+        if not yarns_by_id:
+            return {"yarn_ids": []}
+        
+        # Create any missing yarn types, then the stash entries, each as one batched insert
+        db.execute(insert_or_ignore(YarnType), [
+            {"yarn_id": yarn_id, "yarn_name": yarn.yarn_name, "brand": yarn.brand,
+             "weight": yarn.weight, "fiber": yarn.fiber}
+            for yarn_id, yarn in yarns_by_id.items()
+        ])
+        already_owned = {
+            row.yarn_id for row in db.query(OwnsYarn.yarn_id).filter(
+                OwnsYarn.user_id == user_id, OwnsYarn.yarn_id.in_(list(yarns_by_id))
+            )
+        }
+        added = [yarn_id for yarn_id in yarns_by_id if yarn_id not in already_owned]
+        if added:
+            db.execute(insert_or_ignore(OwnsYarn), [
+                {"user_id": user_id, "yarn_id": yarn_id,
+                 "yardage": yarns_by_id[yarn_id].yardage, "grams": yarns_by_id[yarn_id].grams}
+                for yarn_id in added
+            ])
+        
+        # Commit all operations together
+        db.commit()
+        
+        return {"yarn_ids": added}
+    except HTTPException:
+        db.rollback()
+        raise
+    except Exception as e:
+        db.rollback()
+        raise HTTPException(status_code=500, detail=f"Error adding yarn: {str(e)}")
 
 @app.get("/users/{user_id}/tools/")
-def get_user_tools(user_id: int):
-    db = SessionLocal()
-    
+def get_user_tools(user_id: int, db: Session = Depends(get_db)):
     # Check if user exists
-    user = db.query(User).filter(User.user_id == user_id).first()
-    if not user:
-        db.close()
-        raise HTTPException(status_code=404, detail="User not found")
+    require_user(db, user_id)
     
     # Get all tools owned by the user
-    tools = db.query(Tool).join(OwnsTool).filter(OwnsTool.user_id == user_id).all()
+    tools = db.execute(USER_TOOLS, {"user_id": user_id}).all()
     
     result = []
     for tool in tools:
@@ -1012,92 +1396,26 @@ def get_user_tools(user_id: int):
             "size": tool.size
         })
     
-    db.close()
     return result
 
 @app.post("/users/{user_id}/tools/")
-def add_tool(user_id: int, tool: ToolCreate):
-    db = SessionLocal()
+def add_tool(user_id: int, tool: ToolCreate, db: Session = Depends(get_db)):
     try:
         # Check if user exists
-        user_obj = db.query(User).filter(User.user_id == user_id).first()
-        if not user_obj:
-            raise HTTPException(status_code=404, detail="User not found")
+        require_user(db, user_id)
         
-        # Check if tool already exists (due to UNIQUE constraint)
-        existing_tool = db.query(Tool).filter(
-            Tool.type == tool.type,
-            Tool.size == tool.size
-        ).first()
+        tool_id, created = add_tool_to_user(db, user_id, tool)
+        db.commit()
         
-        if existing_tool:
-            # Tool already exists, check if user already owns it
-            existing_ownership = db.query(OwnsTool).filter(
-                OwnsTool.user_id == user_id,
-                OwnsTool.tool_id == existing_tool.tool_id
-            ).first()
-            
-            if existing_ownership:
-                # User already owns this tool
-                raise HTTPException(status_code=400, detail="You already own this tool")
-            
-            # Create ownership relationship for existing tool
-            db_owns = OwnsTool(user_id=user_id, tool_id=existing_tool.tool_id)
-            db.add(db_owns)
-            db.commit()
-            
-            return {"tool_id": existing_tool.tool_id, "message": "Tool added to your collection"}
-        else:
-            # Create new tool
-            db_tool = Tool(type=tool.type, size=tool.size)
-            db.add(db_tool)
-            
-            try:
-                db.flush()  # This will fail if there's a unique constraint violation
-            except Exception as flush_error:
-                # Handle the case where another request created the same tool between our check and insert
-                db.rollback()
-                
-                # Try to find the tool that was just created
-                existing_tool = db.query(Tool).filter(
-                    Tool.type == tool.type,
-                    Tool.size == tool.size
-                ).first()
-                
-                if existing_tool:
-                    # Check if user already owns it
-                    existing_ownership = db.query(OwnsTool).filter(
-                        OwnsTool.user_id == user_id,
-                        OwnsTool.tool_id == existing_tool.tool_id
-                    ).first()
-                    
-                    if existing_ownership:
-                        raise HTTPException(status_code=400, detail="You already own this tool")
-                    
-                    # Create ownership for the existing tool
-                    db_owns = OwnsTool(user_id=user_id, tool_id=existing_tool.tool_id)
-                    db.add(db_owns)
-                    db.commit()
-                    
-                    return {"tool_id": existing_tool.tool_id, "message": "Tool added to your collection"}
-                else:
-                    # Re-raise the original error if we can't find the tool
-                    raise HTTPException(status_code=500, detail=f"Database error: {str(flush_error)}")
-            
-            # If flush succeeded, create ownership relationship
-            db_owns = OwnsTool(user_id=user_id, tool_id=db_tool.tool_id)
-            db.add(db_owns)
-            db.commit()
-            
-            return {"tool_id": db_tool.tool_id, "message": "New tool created and added to your collection"}
+        if created:
+            return {"tool_id": tool_id, "message": "New tool created and added to your collection"}
+        return {"tool_id": tool_id, "message": "Tool added to your collection"}
             
     except HTTPException:
         # Re-raise HTTP exceptions
-        db.close()
         raise
     except Exception as e:
         db.rollback()
-        db.close()
         print(f"[ERROR] Error adding tool: {str(e)}")
         print(f"[ERROR] Tool data: type='{tool.type}', size='{tool.size}'")
         print(f"[ERROR] User ID: {user_id}")
@@ -1106,100 +1424,50 @@ def add_tool(user_id: int, tool: ToolCreate):
 
 
 @app.delete("/users/{user_id}/tools/{tool_id}")
-def delete_user_tool(user_id: int, tool_id: int):
-    db = SessionLocal()
-    
+def delete_user_tool(user_id: int, tool_id: int, db: Session = Depends(get_db)):
     # Check if user exists
-    user = db.query(User).filter(User.user_id == user_id).first()
-    if not user:
-        db.close()
-        raise HTTPException(status_code=404, detail="User not found")
+    require_user(db, user_id)
     
-    # Check if the tool exists and is owned by the user
-    owns_tool = db.query(OwnsTool).filter(
-        OwnsTool.user_id == user_id,
-        OwnsTool.tool_id == tool_id
+    # Delete the ownership relationship; no row back means the user doesn't own the tool
+    deleted = db.execute(
+        delete(OwnsTool).where(
+            OwnsTool.user_id == user_id,
+            OwnsTool.tool_id == tool_id
+        ).returning(OwnsTool.tool_id)
     ).first()
     
-    if not owns_tool:
-        db.close()
+    if deleted is None:
         raise HTTPException(status_code=404, detail="Tool not found or not owned by user")
     
-    # Delete the ownership relationship
-    db.delete(owns_tool)
-    
-    # Check if any other users own this tool
-    other_owners = db.query(OwnsTool).filter(OwnsTool.tool_id == tool_id).count()
-    
-    # If no other users own this tool, delete the tool itself
-    if other_owners == 0:
-        tool = db.query(Tool).filter(Tool.tool_id == tool_id).first()
-        if tool:
-            db.delete(tool)
+    # If no other users own this tool and no pattern requires it, delete the tool itself
+    db.execute(
+        delete(Tool).where(
+            Tool.tool_id == tool_id,
+            ~exists().where(OwnsTool.tool_id == tool_id),
+            ~exists().where(PatternRequiresTool.tool_id == tool_id)
+        )
+    )
     
     db.commit()
-    db.close()
     return {"message": "Tool deleted successfully"}
 
 @app.post("/users/{user_id}/tools/alternative")
-def add_tool_alternative(user_id: int, tool: ToolCreate):
+def add_tool_alternative(user_id: int, tool: ToolCreate, db: Session = Depends(get_db)):
     """Alternative approach using get_or_create pattern"""
-    db = SessionLocal()
     try:
         # Check if user exists
-        user_obj = db.query(User).filter(User.user_id == user_id).first()
-        if not user_obj:
-            raise HTTPException(status_code=404, detail="User not found")
-        
-        # Get or create tool (handles unique constraint gracefully)
-        existing_tool = db.query(Tool).filter(
-            Tool.type == tool.type,
-            Tool.size == tool.size
-        ).first()
-        
-        if not existing_tool:
-            # Try to create new tool
-            try:
-                db_tool = Tool(type=tool.type, size=tool.size)
-                db.add(db_tool)
-                db.flush()
-                tool_to_use = db_tool
-            except Exception as create_error:
-                # If creation failed due to unique constraint, try to get it again
-                db.rollback()
-                existing_tool = db.query(Tool).filter(
-                    Tool.type == tool.type,
-                    Tool.size == tool.size
-                ).first()
-                if existing_tool:
-                    tool_to_use = existing_tool
-                else:
-                    raise HTTPException(status_code=500, detail=f"Could not create or find tool: {str(create_error)}")
-        else:
-            tool_to_use = existing_tool
-        
-        # Check if user already owns this tool
-        existing_ownership = db.query(OwnsTool).filter(
-            OwnsTool.user_id == user_id,
-            OwnsTool.tool_id == tool_to_use.tool_id
-        ).first()
+        require_user(db, user_id)
         
-        if existing_ownership:
-            raise HTTPException(status_code=400, detail="You already own this tool")
-        
-        # Create ownership relationship
-        db_owns = OwnsTool(user_id=user_id, tool_id=tool_to_use.tool_id)
-        db.add(db_owns)
+        # Get or create tool and link it to the user
+        tool_id, _ = add_tool_to_user(db, user_id, tool)
         db.commit()
         
-        return {"tool_id": tool_to_use.tool_id, "message": "Tool added to your collection"}
+        return {"tool_id": tool_id, "message": "Tool added to your collection"}
         
     except HTTPException:
-        db.close()
         raise
     except Exception as e:
         db.rollback()
-        db.close()
         print(f"[ERROR] Error in alternative add_tool: {str(e)}")
         raise HTTPException(status_code=500, detail=f"Error: {str(e)}")
 
@@ -1216,7 +1484,9 @@ def get_all_patterns(
     shuffle: Optional[bool] = None,
     free_only: Optional[bool] = None,
     user_id: Optional[int] = None,
-    name: Optional[str] = None  # <-- Add this line
+    name: Optional[str] = None,  # <-- Add this line
+    cursor: Optional[int] = None,
+    db: Session = Depends(get_db)
 ):
     # Validate pagination parameters
     if page < 1:
@@ -1226,16 +1496,26 @@ def get_all_patterns(
     if page_size > 100:
         page_size = 100
     
-    db = SessionLocal()
+    # Serve repeated requests from the page cache; shuffled pages are never cached
+    page_key = None if shuffle else (
+        project_type, craft_type, weight, designer, uploaded_only, user_id,
+        free_only, page, page_size, name, cursor
+    )
+    if page_key is not None:
+        cached_page = get_cached_pattern_page(page_key)
+        if cached_page is not None:
+            return cached_page
+    cache_generation = _pattern_cache_generation
+    
     try:
-        # Start with all patterns
-        query = db.query(Pattern)
+        # Start with all pattern ids; related data is loaded for the current page only
+        query = db.query(Pattern.pattern_id)
         # Apply filters
         if project_type:
             # Map frontend project type to database value
             db_project_type = map_frontend_project_type_to_db(project_type)
-            query = query.join(SuitableFor).join(ProjectType).filter(
-                ProjectType.name == db_project_type
+            query = query.join(SuitableFor).filter(
+                SuitableFor.project_type_id == get_project_type_id(db, db_project_type)
             )
         if craft_type:
             query = query.join(RequiresCraftType).join(CraftType).filter(
@@ -1251,116 +1531,79 @@ def get_all_patterns(
             query = query.filter(Pattern.name.ilike(f"%{name}%"))
         if uploaded_only:
             if not user_id:
-                db.close()
                 raise HTTPException(status_code=400, detail="user_id is required when uploaded_only is true")
             # Only show patterns uploaded by this user
             query = query.join(OwnsPattern).filter(OwnsPattern.user_id == user_id)
         if free_only:
-            # Filter for patterns that have free prices in HasLink_Link
+            # Filter for patterns that have a free link (see FREE_LINK_PRICES)
             query = query.filter(
-                db.query(HasLink_Link.pattern_id).filter(
-                    (HasLink_Link.pattern_id == Pattern.pattern_id) &
-                    ((HasLink_Link.price.ilike('free')) |
-                     (HasLink_Link.price == '0') |
-                     (HasLink_Link.price == '0.0') |
-                     (HasLink_Link.price.ilike('$0.00')) |
-                     (HasLink_Link.price.ilike('0.0 gbp')) |
-                     (HasLink_Link.price.ilike('0.0 dkk')) |
-                     (HasLink_Link.price.ilike('0.0 usd')))
-                ).exists()
+                exists().where(HasLink_Link.pattern_id == Pattern.pattern_id, HasLink_Link.is_free)
             )
-        # Get total count for pagination
-        total_count = query.count()
-        # Apply pagination - ensure page_size is not zero
-        if page_size <= 0:
-            page_size = 30
-        offset = (page - 1) * page_size
-        patterns = query.limit(page_size).offset(offset).all()
-        # Build response with related data
-        result = []
-        for pattern in patterns:
-            # Get craft type
-            craft_type_result = db.query(CraftType.name).join(RequiresCraftType).filter(
-                RequiresCraftType.pattern_id == pattern.pattern_id
-            ).first()
-            craft_type_name = craft_type_result[0] if craft_type_result else None
-            # Get project type
-            project_type_result = db.query(ProjectType.name).join(SuitableFor).filter(
-                SuitableFor.pattern_id == pattern.pattern_id
-            ).first()
-            project_type_name = project_type_result[0] if project_type_result else None
-            # Get yarn weight and yardage/grams from PatternSuggestsYarn
-            yarn_result = db.query(
-                YarnType.weight, PatternSuggestsYarn.yardage_min, PatternSuggestsYarn.yardage_max, PatternSuggestsYarn.grams_min, PatternSuggestsYarn.grams_max
-            ).join(PatternSuggestsYarn).filter(
-                PatternSuggestsYarn.pattern_id == pattern.pattern_id
-            ).first()
-            yarn_weight = yarn_result[0] if yarn_result else None
-            yardage_min = yarn_result[1] if yarn_result else None
-            yardage_max = yarn_result[2] if yarn_result else None
-            grams_min = yarn_result[3] if yarn_result else None
-            grams_max = yarn_result[4] if yarn_result else None
-            # Get pattern link and price
-            link_result = db.query(HasLink_Link.url, HasLink_Link.price).filter(
-                HasLink_Link.pattern_id == pattern.pattern_id
-            ).first()
-            # For imported patterns, use the HasLink_Link price and URL
-            if link_result:
-                pattern_url = link_result[0]  # Get the URL
-                # Format price for display
-                price_value = link_result[1]
-                if price_value is not None:
-                    if price_value.lower() == 'free' or price_value == '0' or price_value == '0.0':
-                        price_display = "Free"
-                    else:
-                        # Keep the original price string as it may contain currency info
-                        price_display = price_value
-                else:
-                    price_display = None
-            else:
-                # This is a user-uploaded pattern, no price or URL
-                pattern_url = None
-                price_display = None
-            result.append(PatternResponse(
-                pattern_id=pattern.pattern_id,
-                name=pattern.name,
-                designer=pattern.designer,
-                image=pattern.image if pattern.image is not None else "/placeholder.svg",
-                google_drive_file_id=pattern.google_drive_file_id,
-                yardage_min=yardage_min,
-                yardage_max=yardage_max,
-                grams_min=grams_min,
-                grams_max=grams_max,
-                project_type=project_type_name,
-                craft_type=craft_type_name,
-                required_weight=yarn_weight,
-                pattern_url=pattern_url,
-                price=price_display
-            ))
-        # Remove Python-side free_only filtering
-        # Shuffle results if requested (after filtering)
-        if shuffle:
-            random.shuffle(result)
-        # Calculate pagination info - ensure page_size is not zero to prevent division by zero
-        if page_size <= 0:
-            page_size = 30
-        total_pages = (total_count + page_size - 1) // page_size
-        return PaginatedPatternResponse(
-            patterns=result,
-            pagination={
-                "page": page,
-                "page_size": page_size,
-                "total": total_count,
-                "pages": total_pages,
-                "has_next": page < total_pages,
-                "has_prev": page > 1
-            }
-        )
+        # Filter joins can repeat a pattern; list each one once, in a stable order, or in a
+        # random order across all matches when shuffling (cursor pages always seek by id)
+        query = query.group_by(Pattern.pattern_id)
+        if shuffle and cursor is None:
+            query = query.order_by(func.random())
+        else:
+            query = query.order_by(Pattern.pattern_id)
+        if cursor is not None:
+            # Keyset pagination: seek past the last pattern_id of the previous page
+            # instead of scanning and discarding OFFSET rows
+            page_ids = [row.pattern_id for row in query.filter(Pattern.pattern_id > cursor).limit(page_size + 1).all()]
+            has_next = len(page_ids) > page_size
+            page_ids = page_ids[:page_size]
+        else:
+            # Get total count for pagination (cached briefly per filter combination); on a
+            # cache miss it runs concurrently with the page queries below
+            count_key = (project_type, craft_type, weight, designer, name, bool(free_only),
+                         user_id if uploaded_only else None)
+            count_future = start_pattern_count(count_key, query)
+            # Apply pagination - ensure page_size is not zero
+            if page_size <= 0:
+                page_size = 30
+            offset = (page - 1) * page_size
+            page_ids = [row.pattern_id for row in query.limit(page_size).offset(offset).all()]
+        # Build response with related data, in one query for the whole page
+        rows_by_id = {
+            row.pattern_id: row
+            for row in pattern_listing_query(db).filter(Pattern.pattern_id.in_(page_ids)).all()
+        }
+        result = [pattern_response_from_row(rows_by_id[pattern_id]) for pattern_id in page_ids]
+        if cursor is None:
+            total_count = count_future.result()
+        if cursor is not None:
+            # Cursor pages don't count the whole result set
+            response = PaginatedPatternResponse(
+                patterns=result,
+                pagination={
+                    "page_size": page_size,
+                    "has_next": has_next,
+                    "has_prev": True,
+                    "next_cursor": page_ids[-1] if has_next else None
+                }
+            )
+        else:
+            # Calculate pagination info - ensure page_size is not zero to prevent division by zero
+            if page_size <= 0:
+                page_size = 30
+            total_pages = (total_count + page_size - 1) // page_size
+            response = PaginatedPatternResponse(
+                patterns=result,
+                pagination={
+                    "page": page,
+                    "page_size": page_size,
+                    "total": total_count,
+                    "pages": total_pages,
+                    "has_next": page < total_pages,
+                    "has_prev": page > 1,
+                    "next_cursor": page_ids[-1] if page < total_pages and page_ids and not shuffle else None
+                }
+            )
+        if page_key is not None:
+            cache_pattern_page(page_key, response, cache_generation)
+        return response
     except Exception as e:
-        db.close()
         raise HTTPException(status_code=500, detail=f"Database error: {str(e)}")
-    finally:
-        db.close()
 
 @app.get("/test")
 def test_endpoint():
@@ -1372,14 +1615,14 @@ def test_cors():
     return {"message": "CORS test successful", "timestamp": "2024-01-01T00:00:00Z"}
 
 @app.get("/test-db")
-def test_database():
+def test_database(db: Session = Depends(get_db)):
     """Test database connection and table creation"""
-    db = SessionLocal()
     try:
-        # Test if tables exist by trying to query them
-        pattern_count = db.query(Pattern).count()
-        user_count = db.query(User).count()
-        db.close()
+        # Test if tables exist by counting both in a single round trip
+        pattern_count, user_count = db.query(
+            db.query(func.count(Pattern.pattern_id)).scalar_subquery(),
+            db.query(func.count(User.user_id)).scalar_subquery()
+        ).one()
         return {
             "message": "Database connection successful",
             "pattern_count": pattern_count,
@@ -1388,7 +1631,6 @@ def test_database():
             "database_url": DATABASE_URL[:20] + "..." if DATABASE_URL else "Not set"
         }
     except Exception as e:
-        db.close()
         return {
             "message": "Database error",
             "error": str(e),
@@ -1405,8 +1647,7 @@ def debug_environment():
     }
 
 @app.get("/test-patterns")
-def test_patterns():
-    db = SessionLocal()
+def test_patterns(db: Session = Depends(get_db)):
     try:
         patterns = db.query(Pattern).limit(5).all()
         result = []
@@ -1416,15 +1657,12 @@ def test_patterns():
                 "name": p.name,
                 "designer": p.designer
             })
-        db.close()
         return {"patterns": result}
     except Exception as e:
-        db.close()
         return {"error": str(e)}
 
 @app.get("/test-craft-types")
-def test_craft_types():
-    db = SessionLocal()
+def test_craft_types(db: Session = Depends(get_db)):
     try:
         craft_types = db.query(CraftType).all()
         result = []
@@ -1438,15 +1676,12 @@ def test_craft_types():
                 "name": ct.name,
                 "pattern_count": pattern_count
             })
-        db.close()
         return {"craft_types": result}
     except Exception as e:
-        db.close()
         return {"error": str(e)}
 
 @app.get("/test-link-prices")
-def test_link_prices():
-    db = SessionLocal()
+def test_link_prices(db: Session = Depends(get_db)):
     try:
         # Get some sample patterns with their link prices
         links = db.query(HasLink_Link).limit(10).all()
@@ -1458,15 +1693,12 @@ def test_link_prices():
                 "price": link.price,
                 "source": link.source
             })
-        db.close()
         return {"links": result}
     except Exception as e:
-        db.close()
         return {"error": str(e)}
 
 @app.get("/test-specific-patterns")
-def test_specific_patterns():
-    db = SessionLocal()
+def test_specific_patterns(db: Session = Depends(get_db)):
     try:
         # Check specific patterns that were showing price 0.0
         pattern_ids = [167, 278, 296, 313, 332]
@@ -1484,26 +1716,20 @@ def test_specific_patterns():
                     "link_price": link.price if link else None,
                     "link_url": link.url if link else None
                 })
-        db.close()
         return {"patterns": result}
     except Exception as e:
-        db.close()
         return {"error": str(e)}
 
 @app.post("/upload-pdf/{pattern_id}")
-async def upload_pdf(pattern_id: int, file: UploadFile = File(...)):
+async def upload_pdf(pattern_id: int, background_tasks: BackgroundTasks, file: UploadFile = File(...), db: Session = Depends(get_db)):
     """Upload a PDF file for a specific pattern"""
-    db = SessionLocal()
-    
     # Check if pattern exists
     pattern = db.query(Pattern).filter(Pattern.pattern_id == pattern_id).first()
     if not pattern:
-        db.close()
         raise HTTPException(status_code=404, detail="Pattern not found")
     
     # Validate file type
     if not file.filename.lower().endswith('.pdf'):
-        db.close()
         raise HTTPException(status_code=400, detail="Only PDF files are allowed")
     
     # Generate unique filename
@@ -1512,49 +1738,39 @@ async def upload_pdf(pattern_id: int, file: UploadFile = File(...)):
     file_path = os.path.join(PDF_UPLOADS_DIR, unique_filename)
     
     try:
-        # Save the file
-        with open(file_path, "wb") as buffer:
-            content = await file.read()
-            buffer.write(content)
+        # Save the file, streaming it in chunks so the whole PDF is never held in memory
+        async with await open_file(file_path, "wb") as buffer:
+            while chunk := await file.read(PDF_UPLOAD_CHUNK_SIZE):
+                await buffer.write(chunk)
         
         # Update pattern with Google Drive file ID
         pattern.google_drive_file_id = unique_filename
         db.commit()
+        invalidate_pattern_caches()
         
-        # Backup to cloud storage
-        try:
-            from cloud_storage import CloudStorage
-            storage = CloudStorage()
-            storage.backup_pdf(pattern_id, unique_filename, file_path)
-        except Exception as cloud_error:
-            print(f"Warning: Failed to backup PDF to cloud storage: {cloud_error}")
+        # Backup to cloud storage once the response has been sent
+        background_tasks.add_task(backup_pdf_to_cloud, pattern_id, unique_filename, file_path)
         
-        db.close()
         return {"message": "PDF uploaded successfully", "filename": unique_filename}
     
     except Exception as e:
-        db.close()
         # Clean up file if it was created
         if os.path.exists(file_path):
             os.remove(file_path)
         raise HTTPException(status_code=500, detail=f"Failed to upload PDF: {str(e)}")
 
 @app.get("/download-pdf/{pattern_id}")
-async def download_pdf(pattern_id: int):
+async def download_pdf(pattern_id: int, db: Session = Depends(get_db)):
     """Download a PDF file for a specific pattern"""
-    db = SessionLocal()
-    
     # Check if pattern exists and has a PDF
     pattern = db.query(Pattern).filter(Pattern.pattern_id == pattern_id).first()
     if not pattern or not pattern.google_drive_file_id:
-        db.close()
         raise HTTPException(status_code=404, detail="PDF not found for this pattern")
     
     # Check if this is a Google Drive file ID (doesn't contain file extension)
     if not pattern.google_drive_file_id.endswith('.pdf'):
         # This is a Google Drive file ID - redirect to Google Drive download
         google_drive_download_url = f"https://drive.google.com/uc?export=download&id={pattern.google_drive_file_id}"
-        db.close()
         return {"redirect_url": google_drive_download_url}
     
     # This is a local file - handle as before
@@ -1568,14 +1784,11 @@ async def download_pdf(pattern_id: int):
             if storage.restore_pdf(pattern.google_drive_file_id, file_path):
                 print(f"✅ Restored PDF from cloud storage: {pattern.google_drive_file_id}")
             else:
-                db.close()
                 raise HTTPException(status_code=404, detail="PDF file not found")
         except Exception as restore_error:
             print(f"Error restoring PDF: {restore_error}")
-            db.close()
             raise HTTPException(status_code=404, detail="PDF file not found")
     
-    db.close()
     return FileResponse(
         path=file_path,
         filename=pattern.google_drive_file_id,
@@ -1583,21 +1796,17 @@ async def download_pdf(pattern_id: int):
     )
 
 @app.get("/view-pdf/{pattern_id}")
-async def view_pdf(pattern_id: int):
+async def view_pdf(pattern_id: int, db: Session = Depends(get_db)):
     """View a PDF file inline in the browser"""
-    db = SessionLocal()
-    
     # Check if pattern exists and has a PDF
     pattern = db.query(Pattern).filter(Pattern.pattern_id == pattern_id).first()
     if not pattern or not pattern.google_drive_file_id:
-        db.close()
         raise HTTPException(status_code=404, detail="PDF not found for this pattern")
     
     # Check if this is a Google Drive file ID (doesn't contain file extension)
     if not pattern.google_drive_file_id.endswith('.pdf'):
         # This is a Google Drive file ID - redirect to Google Drive
         google_drive_url = f"https://drive.google.com/file/d/{pattern.google_drive_file_id}/view"
-        db.close()
         return {"redirect_url": google_drive_url}
     
     # This is a local file - handle as before
@@ -1611,83 +1820,57 @@ async def view_pdf(pattern_id: int):
             if storage.restore_pdf(pattern.google_drive_file_id, file_path):
                 print(f"✅ Restored PDF from cloud storage: {pattern.google_drive_file_id}")
             else:
-                db.close()
                 raise HTTPException(
                     status_code=404, 
                     detail="PDF file not found. Please re-upload the PDF file."
                 )
         except Exception as restore_error:
             print(f"Error restoring PDF: {restore_error}")
-            db.close()
             raise HTTPException(
                 status_code=404, 
                 detail="PDF file not found. Please re-upload the PDF file."
             )
     
-    db.close()
-    return FileResponse(
-        path=file_path,
-        media_type='application/pdf',
-        headers={'Content-Disposition': 'inline'}
-    )
+    # Hand off to the static mount, which the browser can cache and revalidate
+    return RedirectResponse(f"{PDF_STATIC_PATH}/{pattern.google_drive_file_id}", status_code=307)
 
 @app.get("/debug/free-patterns")
-def debug_free_patterns():
-    db = SessionLocal()
-    patterns = db.query(Pattern).all()
-    result = []
-    for pattern in patterns:
-        # Get pattern link and price
-        link_result = db.query(HasLink_Link.url, HasLink_Link.price).filter(
-            HasLink_Link.pattern_id == pattern.pattern_id
-        ).first()
-        if link_result:
-            link_price = link_result[1]
-        else:
-            link_price = None
-        if link_price is None or link_price == 0 or link_price == 0.0:
-            price_str = "Free"
-        else:
-            price_str = str(link_price)
-        result.append({
-            "pattern_id": pattern.pattern_id,
-            "name": pattern.name,
-            "link_price": link_price,
-            "price_str": price_str
-        })
-    db.close()
-    # Only return those marked as Free
-    return [p for p in result if p["price_str"] == "Free"]
+def debug_free_patterns(db: Session = Depends(get_db)):
+    # Patterns whose (first) link has no price, or that have no link at all
+    rows = pattern_listing_query(db).filter(HasLink_Link.price.is_(None)).order_by(Pattern.pattern_id).all()
+    return [
+        {
+            "pattern_id": row.pattern_id,
+            "name": row.name,
+            "link_price": row.price,
+            "price_str": "Free"
+        }
+        for row in rows
+    ]
 
 @app.get("/debug/patterns-yardage")
-def debug_patterns_yardage():
-    db = SessionLocal()
+def debug_patterns_yardage(db: Session = Depends(get_db)):
     try:
-        # Get all patterns with their yardage info
-        patterns = db.query(Pattern).all()
+        # Get all patterns with their (first) yarn suggestion's yardage info
+        rows = pattern_listing_query(db).add_columns(
+            PatternSuggestsYarn.yarn_id.label("suggested_yarn_id")
+        ).order_by(Pattern.pattern_id).all()
         result = []
         
-        for pattern in patterns:
-            # Get yarn weight and yardage/grams from PatternSuggestsYarn
-            yarn_result = db.query(YarnType.weight, PatternSuggestsYarn.yardage_min, PatternSuggestsYarn.yardage_max, PatternSuggestsYarn.grams_min, PatternSuggestsYarn.grams_max).join(PatternSuggestsYarn).filter(
-                PatternSuggestsYarn.pattern_id == pattern.pattern_id
-            ).first()
-            
+        for row in rows:
             result.append({
-                "pattern_id": pattern.pattern_id,
-                "name": pattern.name,
-                "has_yarn_info": yarn_result is not None,
-                "weight": yarn_result[0] if yarn_result else None,
-                "yardage_min": yarn_result[1] if yarn_result else None,
-                "yardage_max": yarn_result[2] if yarn_result else None,
-                "grams_min": yarn_result[3] if yarn_result else None,
-                "grams_max": yarn_result[4] if yarn_result else None
+                "pattern_id": row.pattern_id,
+                "name": row.name,
+                "has_yarn_info": row.suggested_yarn_id is not None,
+                "weight": row.required_weight,
+                "yardage_min": row.yardage_min,
+                "yardage_max": row.yardage_max,
+                "grams_min": row.grams_min,
+                "grams_max": row.grams_max
             })
         
-        db.close()
         return {"patterns": result}
     except Exception as e:
-        db.close()
         return {"error": str(e)}
 
 @app.get("/patterns/stash-match/{user_id}", response_model=PaginatedPatternResponse)
@@ -1701,9 +1884,11 @@ def get_stash_matching_patterns(
     weight: Optional[str] = None,
     designer: Optional[str] = None,
     free_only: Optional[bool] = None,
-    name: Optional[str] = None  # <-- Add this line
+    name: Optional[str] = None,  # <-- Add this line
+    cursor: Optional[int] = None,
+    db: Session = Depends(get_db)
 ):
-    print(f"[DEBUG] stash-match params: user_id={user_id}, page={page}, page_size={page_size}, uploaded_only={uploaded_only}, project_type={project_type}, craft_type={craft_type}, weight={weight}, designer={designer}, free_only={free_only}, name={name}")
+    print(f"[DEBUG] stash-match params: user_id={user_id}, page={page}, page_size={page_size}, uploaded_only={uploaded_only}, project_type={project_type}, craft_type={craft_type}, weight={weight}, designer={designer}, free_only={free_only}, name={name}, cursor={cursor}")
     
     # Validate pagination parameters
     if page < 1:
@@ -1713,14 +1898,11 @@ def get_stash_matching_patterns(
     if page_size > 100000:
         page_size = 100000
     
-    db = SessionLocal()
-    
     # Get user's yarn stash
-    stash_query = db.query(OwnsYarn, YarnType).join(YarnType).filter(OwnsYarn.user_id == user_id)
-    stash_items = stash_query.all()
+    # Total yardage by weight class (same as frontend), summed in the database
+    stash_yardage_by_weight = dict(db.execute(USER_STASH_YARDAGE_BY_WEIGHT, {"user_id": user_id}).all())
     
-    if not stash_items:
-        db.close()
+    if not stash_yardage_by_weight:
         return PaginatedPatternResponse(
             patterns=[],
             pagination={
@@ -1729,123 +1911,44 @@ def get_stash_matching_patterns(
                 "total": 0,
                 "pages": 0,
                 "has_next": False,
-                "has_prev": False
+                "has_prev": cursor is not None,
+                "next_cursor": None
             }
         )
     
-    # Calculate total yardage by weight class (same as frontend)
-    stash_yardage_by_weight = {}
-    for stash_item, yarn_type in stash_items:
-        weight_key = yarn_type.weight
-        if weight_key not in stash_yardage_by_weight:
-            stash_yardage_by_weight[weight_key] = 0
-        stash_yardage_by_weight[weight_key] += stash_item.yardage
-    
     print(f"[DEBUG] stash-match stash yardage by weight: {stash_yardage_by_weight}")
     
-    # Frontend weight mapping logic (exact copy from PatternCard.tsx)
-    def get_weight_mapping():
-        return {
-            'lace': ['Lace'],
-            'cobweb': ['Cobweb'],
-            'thread': ['Thread'],
-            'light-fingering': ['Light Fingering'],
-            'fingering': ['Fingering (14 wpi)', 'Fingering'],
-            'sport': ['Sport (12 wpi)', 'Sport'],
-            'dk': ['DK (11 wpi)', 'DK'],
-            'worsted': ['Worsted (9 wpi)', 'Worsted'],
-            'aran': ['Aran (8 wpi)', 'Aran'],
-            'bulky': ['Bulky (7 wpi)', 'Bulky'],
-            'super-bulky': ['Super Bulky (5-6 wpi)', 'Super Bulky'],
-            'jumbo': ['Jumbo (0-4 wpi)', 'Jumbo'],
-            # Add full weight strings as keys for direct lookup
-            'Lace': ['Lace'],
-            'Cobweb': ['Cobweb'],
-            'Thread': ['Thread'],
-            'Light Fingering': ['Light Fingering'],
-            'Fingering (14 wpi)': ['Fingering (14 wpi)', 'Fingering'],
-            'Sport (12 wpi)': ['Sport (12 wpi)', 'Sport'],
-            'DK (11 wpi)': ['DK (11 wpi)', 'DK'],
-            'Worsted (9 wpi)': ['Worsted (9 wpi)', 'Worsted'],
-            'Aran (8 wpi)': ['Aran (8 wpi)', 'Aran'],
-            'Bulky (7 wpi)': ['Bulky (7 wpi)', 'Bulky'],
-            'Super Bulky (5-6 wpi)': ['Super Bulky (5-6 wpi)', 'Super Bulky'],
-            'Jumbo (0-4 wpi)': ['Jumbo (0-4 wpi)', 'Jumbo']
-        }
-    
-    # Held yarn weight calculations (exact copy from frontend)
-    def get_held_yarn_calculations():
-        return {
-            'thread': [
-                {'weight': 'Lace', 'description': '2 strands of thread = Lace weight'}
-            ],
-            'lace': [
-                {'weight': 'Fingering (14 wpi)', 'description': '2 strands of lace = Fingering to Sport weight'},
-                {'weight': 'Sport (12 wpi)', 'description': '2 strands of lace = Fingering to Sport weight'}
-            ],
-            'fingering': [
-                {'weight': 'DK (11 wpi)', 'description': '2 strands of fingering = DK weight'}
-            ],
-            'sport': [
-                {'weight': 'DK (11 wpi)', 'description': '2 strands of sport = DK or Light Worsted'},
-                {'weight': 'Worsted (9 wpi)', 'description': '2 strands of sport = DK or Light Worsted'}
-            ],
-            'dk': [
-                {'weight': 'Worsted (9 wpi)', 'description': '2 strands of DK = Worsted or Aran'},
-                {'weight': 'Aran (8 wpi)', 'description': '2 strands of DK = Worsted or Aran'}
-            ],
-            'worsted': [
-                {'weight': 'Bulky (7 wpi)', 'description': '2 strands of Worsted = Chunky'}
-            ],
-            'aran': [
-                {'weight': 'Bulky (7 wpi)', 'description': '2 strands of Aran = Chunky to Super Bulky'},
-                {'weight': 'Super Bulky (5-6 wpi)', 'description': '2 strands of Aran = Chunky to Super Bulky'}
-            ],
-            'bulky': [
-                {'weight': 'Super Bulky (5-6 wpi)', 'description': '2 strands of Chunky = Super Bulky to Jumbo'},
-                {'weight': 'Jumbo (0-4 wpi)', 'description': '2 strands of Chunky = Super Bulky to Jumbo'}
-            ]
-        }
-    
-    def normalize_weight(weight_str):
-        """Normalize weight strings for comparison"""
-        import re
-        return re.sub(r'\s*\(\d+\s*wpi\)', '', weight_str.lower())
-    
-    def check_weight_match(stash_weight, pattern_weight):
-        """Check if a weight matches (including held yarn calculations)"""
-        stash_normalized = normalize_weight(stash_weight)
-        pattern_normalized = normalize_weight(pattern_weight)
-        
-        # Direct match
-        if stash_normalized == pattern_normalized:
-            return {'matches': True}
-        
-        # Check weight mapping
-        weight_mapping = get_weight_mapping()
-        possible_pattern_weights = [normalize_weight(w) for w in (weight_mapping.get(stash_weight, []) + weight_mapping.get(stash_weight.lower(), []))]
-        if pattern_normalized in possible_pattern_weights:
-            return {'matches': True}
-        
-        # Check reverse mapping
-        possible_stash_weights = [normalize_weight(w) for w in (weight_mapping.get(pattern_weight, []) + weight_mapping.get(pattern_weight.lower(), []))]
-        if stash_normalized in possible_stash_weights:
-            return {'matches': True}
-        
-        # Check held yarn calculations
-        held_calculations = get_held_yarn_calculations()
-        held_calcs = held_calculations.get(stash_normalized, [])
-        for calc in held_calcs:
-            if normalize_weight(calc['weight']) == pattern_normalized:
-                return {'matches': True, 'description': calc['description']}
-        
-        # Check partial matching for cases like "fingering" vs "Fingering (14 wpi)"
-        if stash_normalized in pattern_normalized or pattern_normalized in stash_normalized:
-            return {'matches': True}
-        
-        return {'matches': False}
-    
-    weight_mapping = get_weight_mapping()
+    # Which stash yarns match a weight depends only on the weight, so match the stash
+    # against each distinct required weight here and let the database do the rest
+    stash_matches_by_weight = {}
+    for required_weight in db.scalars(PATTERN_REQUIRED_WEIGHTS):
+        # Frontend matching logic (exact copy from PatternCard.tsx matchesStash function)
+        matching_yarns = []
+        match_description = ''
+        for stash_weight, stash_yardage in stash_yardage_by_weight.items():
+            # Use the new held yarn calculation logic
+            weight_check = check_weight_match(stash_weight, required_weight)
+            if weight_check['matches']:
+                matching_yarns.append((stash_weight, stash_yardage))
+                if 'description' in weight_check:
+                    match_description = weight_check['description']
+        # Calculate total yardage for matching yarns
+        total_yardage = sum(yardage for _, yardage in matching_yarns)
+        if total_yardage == 0:
+            continue  # No matching yarn weight, or no yarn in this weight class
+        stash_matches_by_weight[required_weight] = (total_yardage, match_description)
+    
+    # Weights the stash covers, grouped by how much yarn it has for them
+    weights_by_total_yardage = {}
+    for required_weight, (total_yardage, _) in stash_matches_by_weight.items():
+        weights_by_total_yardage.setdefault(total_yardage, []).append(required_weight)
+    # The stash must cover the max yardage when there is one, else the min; patterns
+    # without yardage info never match (same as frontend)
+    required_yardage = func.coalesce(PatternSuggestsYarn.yardage_max, PatternSuggestsYarn.yardage_min)
+    stash_covers_yarn = or_(false(), *(
+        and_(YarnType.weight.in_(weights), required_yardage <= total_yardage)
+        for total_yardage, weights in weights_by_total_yardage.items()
+    ))
     
     # Get all patterns with yarn suggestions
     patterns_query = db.query(
@@ -1875,133 +1978,86 @@ def get_stash_matching_patterns(
         ProjectType, SuitableFor.project_type_id == ProjectType.project_type_id
     ).outerjoin(
         HasLink_Link, Pattern.pattern_id == HasLink_Link.pattern_id
-    )
+    ).filter(stash_covers_yarn)
     
-    # Apply filters before matching
+    # Apply filters
     if uploaded_only:
         patterns_query = patterns_query.join(OwnsPattern).filter(OwnsPattern.user_id == user_id)
     if project_type and project_type != 'any':
         db_project_type = map_frontend_project_type_to_db(project_type)
-        patterns_query = patterns_query.filter(ProjectType.name == db_project_type)
+        project_type_id = get_project_type_id(db, db_project_type)
+        # SuitableFor is outer-joined, so comparing to a missing id (IS NULL) would match
+        # every pattern without a project type; an unknown project type matches nothing
+        patterns_query = patterns_query.filter(
+            SuitableFor.project_type_id == project_type_id if project_type_id is not None else false()
+        )
     if craft_type and craft_type != 'any':
         patterns_query = patterns_query.filter(CraftType.name == craft_type)
     if weight and weight != 'any':
         # Map frontend weight to database weight format
-        weight_mapping_frontend = {
-            'lace': 'Lace',
-            'cobweb': 'Cobweb', 
-            'thread': 'Thread',
-            'light-fingering': 'Light Fingering',
-            'fingering': 'Fingering (14 wpi)',
-            'sport': 'Sport (12 wpi)',
-            'dk': 'DK (11 wpi)',
-            'worsted': 'Worsted (9 wpi)',
-            'aran': 'Aran (8 wpi)',
-            'bulky': 'Bulky (7 wpi)',
-            'super-bulky': 'Super Bulky (5-6 wpi)',
-            'jumbo': 'Jumbo (0-4 wpi)'
-        }
-        db_weight = weight_mapping_frontend.get(weight, weight)
+        db_weight = FRONTEND_WEIGHT_TO_DB.get(weight, weight)
         patterns_query = patterns_query.filter(YarnType.weight == db_weight)
     if designer and designer.strip():
         patterns_query = patterns_query.filter(Pattern.designer.ilike(f'%{designer}%'))
     if name and name.strip():
         patterns_query = patterns_query.filter(Pattern.name.ilike(f'%{name}%'))
     if free_only:
-        patterns_query = patterns_query.filter(
-            (HasLink_Link.price.ilike('free')) |
-            (HasLink_Link.price == '0') |
-            (HasLink_Link.price == '0.0') |
-            (HasLink_Link.price.ilike('$0.00')) |
-            (HasLink_Link.price.ilike('0.0 gbp')) |
-            (HasLink_Link.price.ilike('0.0 dkk')) |
-            (HasLink_Link.price.ilike('0.0 usd'))
-        )
-    
-    # Get all patterns
-    all_patterns = patterns_query.all()
-    print(f"[DEBUG] stash-match total patterns before matching: {len(all_patterns)}")
-    
-    # Apply frontend matching logic to each pattern
-    matching_patterns = []
-    for result in all_patterns:
-        if not result.required_weight:
-            continue  # Skip patterns without weight info (same as frontend)
-        
-        # Frontend matching logic (exact copy from PatternCard.tsx matchesStash function)
-        matching_yarns = []
-        match_description = ''
-        for stash_weight, stash_yardage in stash_yardage_by_weight.items():
-            # Use the new held yarn calculation logic
-            weight_check = check_weight_match(stash_weight, result.required_weight)
-            if weight_check['matches']:
-                matching_yarns.append((stash_weight, stash_yardage))
-                if 'description' in weight_check:
-                    match_description = weight_check['description']
-        
-        if not matching_yarns:
-            continue  # No matching yarn weight
-        
-        # Calculate total yardage for matching yarns
-        total_yardage = sum(yardage for _, yardage in matching_yarns)
-        
-        if total_yardage == 0:
-            continue  # No yarn in this weight class
-        
-        # Handle different yardage scenarios (same as frontend)
-        has_min_yardage = result.yardage_min is not None
-        has_max_yardage = result.yardage_max is not None
-        
-        matches = False
-        if has_min_yardage and has_max_yardage:
-            # Both min and max yardage - stash must be at least as much as max
-            matches = total_yardage >= result.yardage_max
-        elif has_min_yardage:
-            # Only min yardage - stash must have at least this much
-            matches = total_yardage >= result.yardage_min
-        elif has_max_yardage:
-            # Only max yardage - stash must be at least as much as max
-            matches = total_yardage >= result.yardage_max
-        else:
-            # No yardage info - can't determine if stash matches (same as frontend)
-            continue
-        
-        if matches:
-            matching_patterns.append(PatternResponse(
-                pattern_id=result.pattern_id,
-                name=result.name,
-                designer=result.designer,
-                image=result.image if result.image is not None else "/placeholder.svg",
-                google_drive_file_id=result.google_drive_file_id,
-                yardage_min=result.yardage_min,
-                yardage_max=result.yardage_max,
-                grams_min=None,
-                grams_max=None,
-                project_type=result.project_type_name,
-                craft_type=result.craft_type_name,
-                required_weight=result.required_weight,
-                pattern_url=result.url,
-                price=result.price,
-                held_yarn_description=match_description if match_description else None
-            ))
-    
-    print(f"[DEBUG] stash-match patterns matching stash: {len(matching_patterns)}")
-    
-    # Deduplicate by pattern_id
-    seen_pattern_ids = set()
-    unique_matching_patterns = []
-    for pattern in matching_patterns:
-        if pattern.pattern_id not in seen_pattern_ids:
-            seen_pattern_ids.add(pattern.pattern_id)
-            unique_matching_patterns.append(pattern)
-    
-    # Apply pagination
-    total_matching = len(unique_matching_patterns)
-    start_idx = (page - 1) * page_size
-    end_idx = start_idx + page_size
-    paginated_patterns = unique_matching_patterns[start_idx:end_idx]
+        patterns_query = patterns_query.filter(HasLink_Link.is_free)
+    
+    # Page over matching pattern ids in the database, in a stable order so cursors can
+    # seek past the previous page; a pattern matching several ways is listed once
+    page_query = patterns_query.with_entities(Pattern.pattern_id).group_by(
+        Pattern.pattern_id
+    ).order_by(Pattern.pattern_id)
+    if cursor is not None:
+        page_ids = [row.pattern_id for row in page_query.filter(Pattern.pattern_id > cursor).limit(page_size + 1).all()]
+        has_next = len(page_ids) > page_size
+        page_ids = page_ids[:page_size]
+    else:
+        total_matching = page_query.order_by(None).count()
+        print(f"[DEBUG] stash-match patterns matching stash: {total_matching}")
+        offset = (page - 1) * page_size
+        page_ids = [row.pattern_id for row in page_query.limit(page_size).offset(offset).all()]
+    
+    # Build responses for this page only, from the first matching yarn of each pattern
+    # (rows are read back to front so the first row of each pattern is the one kept)
+    page_rows = patterns_query.filter(Pattern.pattern_id.in_(page_ids)).order_by(
+        Pattern.pattern_id, PatternSuggestsYarn.yarn_id
+    ).all()
+    rows_by_id = {result.pattern_id: result for result in reversed(page_rows)}
+    paginated_patterns = []
+    for pattern_id in page_ids:
+        result = rows_by_id[pattern_id]
+        _, match_description = stash_matches_by_weight[result.required_weight]
+        paginated_patterns.append(PatternResponse.model_construct(
+            pattern_id=result.pattern_id,
+            name=result.name,
+            designer=result.designer,
+            image=result.image if result.image is not None else "/placeholder.svg",
+            google_drive_file_id=result.google_drive_file_id,
+            yardage_min=result.yardage_min,
+            yardage_max=result.yardage_max,
+            grams_min=None,
+            grams_max=None,
+            project_type=result.project_type_name,
+            craft_type=result.craft_type_name,
+            required_weight=result.required_weight,
+            pattern_url=result.url,
+            price=result.price,
+            held_yarn_description=match_description if match_description else None
+        ))
     
-    db.close()
+    if cursor is not None:
+        # Cursor pages don't count the whole result set
+        return PaginatedPatternResponse(
+            patterns=paginated_patterns,
+            pagination={
+                "page_size": page_size,
+                "has_next": has_next,
+                "has_prev": True,
+                "next_cursor": page_ids[-1] if has_next else None
+            }
+        )
     
     # Calculate pagination info
     total_pages = (total_matching + page_size - 1) // page_size
@@ -2014,38 +2070,170 @@ def get_stash_matching_patterns(
             "total": total_matching,
             "pages": total_pages,
             "has_next": page < total_pages,
-            "has_prev": page > 1
+            "has_prev": page > 1,
+            "next_cursor": paginated_patterns[-1].pattern_id if page < total_pages and paginated_patterns else None
         }
     )
 
+# Yarn weight mapping used by stash matching (exact copy from PatternCard.tsx)
+WEIGHT_MAPPING = {
+    'lace': ['Lace'],
+    'cobweb': ['Cobweb'],
+    'thread': ['Thread'],
+    'light-fingering': ['Light Fingering'],
+    'fingering': ['Fingering (14 wpi)', 'Fingering'],
+    'sport': ['Sport (12 wpi)', 'Sport'],
+    'dk': ['DK (11 wpi)', 'DK'],
+    'worsted': ['Worsted (9 wpi)', 'Worsted'],
+    'aran': ['Aran (8 wpi)', 'Aran'],
+    'bulky': ['Bulky (7 wpi)', 'Bulky'],
+    'super-bulky': ['Super Bulky (5-6 wpi)', 'Super Bulky'],
+    'jumbo': ['Jumbo (0-4 wpi)', 'Jumbo'],
+    # Add full weight strings as keys for direct lookup
+    'Lace': ['Lace'],
+    'Cobweb': ['Cobweb'],
+    'Thread': ['Thread'],
+    'Light Fingering': ['Light Fingering'],
+    'Fingering (14 wpi)': ['Fingering (14 wpi)', 'Fingering'],
+    'Sport (12 wpi)': ['Sport (12 wpi)', 'Sport'],
+    'DK (11 wpi)': ['DK (11 wpi)', 'DK'],
+    'Worsted (9 wpi)': ['Worsted (9 wpi)', 'Worsted'],
+    'Aran (8 wpi)': ['Aran (8 wpi)', 'Aran'],
+    'Bulky (7 wpi)': ['Bulky (7 wpi)', 'Bulky'],
+    'Super Bulky (5-6 wpi)': ['Super Bulky (5-6 wpi)', 'Super Bulky'],
+    'Jumbo (0-4 wpi)': ['Jumbo (0-4 wpi)', 'Jumbo']
+}
+
+# Held yarn weight calculations (exact copy from frontend)
+HELD_YARN_CALCULATIONS = {
+    'thread': [
+        {'weight': 'Lace', 'description': '2 strands of thread = Lace weight'}
+    ],
+    'lace': [
+        {'weight': 'Fingering (14 wpi)', 'description': '2 strands of lace = Fingering to Sport weight'},
+        {'weight': 'Sport (12 wpi)', 'description': '2 strands of lace = Fingering to Sport weight'}
+    ],
+    'fingering': [
+        {'weight': 'DK (11 wpi)', 'description': '2 strands of fingering = DK weight'}
+    ],
+    'sport': [
+        {'weight': 'DK (11 wpi)', 'description': '2 strands of sport = DK or Light Worsted'},
+        {'weight': 'Worsted (9 wpi)', 'description': '2 strands of sport = DK or Light Worsted'}
+    ],
+    'dk': [
+        {'weight': 'Worsted (9 wpi)', 'description': '2 strands of DK = Worsted or Aran'},
+        {'weight': 'Aran (8 wpi)', 'description': '2 strands of DK = Worsted or Aran'}
+    ],
+    'worsted': [
+        {'weight': 'Bulky (7 wpi)', 'description': '2 strands of Worsted = Chunky'}
+    ],
+    'aran': [
+        {'weight': 'Bulky (7 wpi)', 'description': '2 strands of Aran = Chunky to Super Bulky'},
+        {'weight': 'Super Bulky (5-6 wpi)', 'description': '2 strands of Aran = Chunky to Super Bulky'}
+    ],
+    'bulky': [
+        {'weight': 'Super Bulky (5-6 wpi)', 'description': '2 strands of Chunky = Super Bulky to Jumbo'},
+        {'weight': 'Jumbo (0-4 wpi)', 'description': '2 strands of Chunky = Super Bulky to Jumbo'}
+    ]
+}
+
+# Frontend weight filter values mapped to the database weight format
+FRONTEND_WEIGHT_TO_DB = {
+    'lace': 'Lace',
+    'cobweb': 'Cobweb',
+    'thread': 'Thread',
+    'light-fingering': 'Light Fingering',
+    'fingering': 'Fingering (14 wpi)',
+    'sport': 'Sport (12 wpi)',
+    'dk': 'DK (11 wpi)',
+    'worsted': 'Worsted (9 wpi)',
+    'aran': 'Aran (8 wpi)',
+    'bulky': 'Bulky (7 wpi)',
+    'super-bulky': 'Super Bulky (5-6 wpi)',
+    'jumbo': 'Jumbo (0-4 wpi)'
+}
+
+# The " (14 wpi)"-style suffix ignored when comparing weights
+WPI_SUFFIX_RE = re.compile(r'\s*\(\d+\s*wpi\)')
+
+def normalize_weight(weight_str):
+    """Normalize weight strings for comparison"""
+    return WPI_SUFFIX_RE.sub('', weight_str.lower())
+
+# The tables above with their weights already normalized (keys are looked up as before)
+NORMALIZED_WEIGHT_MAPPING = {
+    key: [normalize_weight(w) for w in weights] for key, weights in WEIGHT_MAPPING.items()
+}
+NORMALIZED_HELD_YARN_CALCULATIONS = {
+    key: [(normalize_weight(calc['weight']), calc['description']) for calc in calcs]
+    for key, calcs in HELD_YARN_CALCULATIONS.items()
+}
+
+# Only a few dozen distinct weight strings exist, and the result depends on nothing else,
+# so each (stash, pattern) pair is worked out once per process. Callers must not mutate
+# the returned dict.
+@functools.lru_cache(maxsize=4096)
+def check_weight_match(stash_weight, pattern_weight):
+    """Check if a weight matches (including held yarn calculations)"""
+    stash_normalized = normalize_weight(stash_weight)
+    pattern_normalized = normalize_weight(pattern_weight)
+    
+    # Direct match
+    if stash_normalized == pattern_normalized:
+        return {'matches': True}
+    
+    # Check weight mapping
+    possible_pattern_weights = NORMALIZED_WEIGHT_MAPPING.get(stash_weight, []) + NORMALIZED_WEIGHT_MAPPING.get(stash_weight.lower(), [])
+    if pattern_normalized in possible_pattern_weights:
+        return {'matches': True}
+    
+    # Check reverse mapping
+    possible_stash_weights = NORMALIZED_WEIGHT_MAPPING.get(pattern_weight, []) + NORMALIZED_WEIGHT_MAPPING.get(pattern_weight.lower(), [])
+    if stash_normalized in possible_stash_weights:
+        return {'matches': True}
+    
+    # Check held yarn calculations
+    held_calcs = NORMALIZED_HELD_YARN_CALCULATIONS.get(stash_normalized, [])
+    for held_weight, description in held_calcs:
+        if held_weight == pattern_normalized:
+            return {'matches': True, 'description': description}
+    
+    # Check partial matching for cases like "fingering" vs "Fingering (14 wpi)"
+    if stash_normalized in pattern_normalized or pattern_normalized in stash_normalized:
+        return {'matches': True}
+    
+    return {'matches': False}
+
+# Frontend project type filter values mapped to the database names
+FRONTEND_PROJECT_TYPE_TO_DB = {
+    'mittens-gloves': 'Mittens/Gloves',
+    'shawl-wrap': 'Shawl/Wrap',
+    'tank-camisole': 'Tank/Camisole',
+    'dress-suit': 'Dress/Suit',
+    'child': 'Child',
+    'hat': 'Hat',
+    'baby': 'Baby',
+    'socks': 'Socks',
+    'scarf': 'Scarf',
+    'home': 'Home',
+    'pullover': 'Pullover',
+    'toys': 'Toys',
+    'pet': 'Pet',
+    'other': 'Other',
+    'shrug': 'Shrug',
+    'blanket': 'Blanket',
+    'cardigan': 'Cardigan',
+    'vest': 'Vest',
+    'tee': 'Tee',
+    'jacket': 'Jacket',
+    'bag': 'Bag',
+    'skirt': 'Skirt',
+    'dishcloth': 'Dishcloth'
+}
+
 def map_frontend_project_type_to_db(frontend_value):
     """Map frontend project type values to database values"""
-    mapping = {
-        'mittens-gloves': 'Mittens/Gloves',
-        'shawl-wrap': 'Shawl/Wrap',
-        'tank-camisole': 'Tank/Camisole',
-        'dress-suit': 'Dress/Suit',
-        'child': 'Child',
-        'hat': 'Hat',
-        'baby': 'Baby',
-        'socks': 'Socks',
-        'scarf': 'Scarf',
-        'home': 'Home',
-        'pullover': 'Pullover',
-        'toys': 'Toys',
-        'pet': 'Pet',
-        'other': 'Other',
-        'shrug': 'Shrug',
-        'blanket': 'Blanket',
-        'cardigan': 'Cardigan',
-        'vest': 'Vest',
-        'tee': 'Tee',
-        'jacket': 'Jacket',
-        'bag': 'Bag',
-        'skirt': 'Skirt',
-        'dishcloth': 'Dishcloth'
-    }
-    return mapping.get(frontend_value, frontend_value)
+    return FRONTEND_PROJECT_TYPE_TO_DB.get(frontend_value, frontend_value)
 
 def get_compatible_weights(pattern_weight):
     """Return list of compatible yarn weights for substitution"""
@@ -2073,33 +2261,28 @@ def get_compatible_weights(pattern_weight):
 
 @app.get("/users/{user_id}/yarn")
 @app.get("/users/{user_id}/yarn/")
-def get_user_yarn(user_id: int):
-    db = SessionLocal()
+def get_user_yarn(user_id: int, db: Session = Depends(get_db)):
     try:
-        stash_query = db.query(OwnsYarn, YarnType).join(YarnType).filter(OwnsYarn.user_id == user_id)
-        stash_items = stash_query.all()
+        stash_items = db.execute(USER_YARN, {"user_id": user_id}).all()
         
         result = []
-        for stash_item, yarn_type in stash_items:
+        for stash_item in stash_items:
             result.append({
-                "yarn_id": yarn_type.yarn_id,
-                "yarn_name": yarn_type.yarn_name,
-                "brand": yarn_type.brand,
-                "weight": yarn_type.weight,
-                "fiber": yarn_type.fiber,
+                "yarn_id": stash_item.yarn_id,
+                "yarn_name": stash_item.yarn_name,
+                "brand": stash_item.brand,
+                "weight": stash_item.weight,
+                "fiber": stash_item.fiber,
                 "yardage": stash_item.yardage,
                 "grams": stash_item.grams
             })
         
-        db.close()
         return {"yarn": result}
     except Exception as e:
-        db.close()
         return {"error": str(e)}
 
 @app.get("/debug/yarn-types")
-def debug_yarn_types():
-    db = SessionLocal()
+def debug_yarn_types(db: Session = Depends(get_db)):
     try:
         yarn_types = db.query(YarnType).limit(10).all()
         result = []
@@ -2111,16 +2294,12 @@ def debug_yarn_types():
                 "weight": yt.weight,
                 "fiber": yt.fiber
             })
-        db.close()
         return {"yarn_types": result}
     except Exception as e:
-        db.close()
         return {"error": str(e)}
 
 @app.get("/debug/user-patterns/{user_id}")
-def debug_user_patterns(user_id: int):
-    db = SessionLocal()
-    
+def debug_user_patterns(user_id: int, db: Session = Depends(get_db)):
     # Get patterns owned by the user
     user_patterns = db.query(Pattern).join(OwnsPattern).filter(OwnsPattern.user_id == user_id).all()
     
@@ -2152,7 +2331,6 @@ def debug_user_patterns(user_id: int):
             "pdf_exists_on_disk": pdf_exists
         })
     
-    db.close()
     return result
 
 @app.get("/debug/pdf-uploads")
@@ -2204,9 +2382,8 @@ def backup_all_pdfs():
         raise HTTPException(status_code=500, detail=f"Failed to backup PDFs: {str(e)}")
 
 @app.get("/debug/project-types")
-def debug_project_types():
+def debug_project_types(db: Session = Depends(get_db)):
     """Debug endpoint to check project types in database"""
-    db = SessionLocal()
     try:
         # Get all project types
         project_types = db.query(ProjectType).all()
@@ -2221,19 +2398,16 @@ def debug_project_types():
                 "pattern_count": pattern_count
             })
         
-        db.close()
         return {
             "project_types": result,
             "total_project_types": len(result)
         }
     except Exception as e:
-        db.close()
         return {"error": str(e)}
 
 @app.get("/debug/patterns-by-project-type")
-def debug_patterns_by_project_type():
+def debug_patterns_by_project_type(db: Session = Depends(get_db)):
     """Debug endpoint to check patterns by project type"""
-    db = SessionLocal()
     try:
         # Get patterns with their project types
         patterns = db.query(
@@ -2254,24 +2428,17 @@ def debug_patterns_by_project_type():
                 "project_type": pattern.project_type_name
             })
         
-        db.close()
         return {
             "patterns": result,
             "total_patterns": len(result)
         }
     except Exception as e:
-        db.close()
         return {"error": str(e)}
 
 @app.put("/users/{user_id}/yarn/{yarn_id}")
-def update_yarn(user_id: int, yarn_id: str, yarn: YarnCreate):
-    db = SessionLocal()
-    
+def update_yarn(user_id: int, yarn_id: str, yarn: YarnCreate, db: Session = Depends(get_db)):
     # Check if user exists
-    user = db.query(User).filter(User.user_id == user_id).first()
-    if not user:
-        db.close()
-        raise HTTPException(status_code=404, detail="User not found")
+    require_user(db, user_id)
     
     # Check if the yarn exists in user's stash
     owns_yarn = db.query(OwnsYarn).filter(
@@ -2280,7 +2447,6 @@ def update_yarn(user_id: int, yarn_id: str, yarn: YarnCreate):
     ).first()
     
     if not owns_yarn:
-        db.close()
         raise HTTPException(status_code=404, detail="Yarn not found in user's stash")
     
     # Update the yarn amounts
@@ -2288,58 +2454,42 @@ def update_yarn(user_id: int, yarn_id: str, yarn: YarnCreate):
     owns_yarn.grams = yarn.grams
     
     db.commit()
-    db.close()
     
     return {"message": "Yarn updated successfully"}
 
 # Favorites endpoints
 @app.post("/users/{user_id}/favorites/{pattern_id}/")
-def add_favorite(user_id: int, pattern_id: int):
-    db = SessionLocal()
-    
+def add_favorite(user_id: int, pattern_id: int, db: Session = Depends(get_db)):
     # Check if user exists
-    user = db.query(User).filter(User.user_id == user_id).first()
-    if not user:
-        db.close()
-        raise HTTPException(status_code=404, detail="User not found")
+    require_user(db, user_id)
     
     # Check if pattern exists
-    pattern = db.query(Pattern).filter(Pattern.pattern_id == pattern_id).first()
-    if not pattern:
-        db.close()
+    if not row_exists(db, Pattern.pattern_id == pattern_id):
         raise HTTPException(status_code=404, detail="Pattern not found")
     
     # Check if already favorited
-    existing_favorite = db.query(FavoritePattern).filter(
+    existing_favorite = row_exists(
+        db,
         FavoritePattern.user_id == user_id,
         FavoritePattern.pattern_id == pattern_id
-    ).first()
+    )
     if existing_favorite:
-        db.close()
         raise HTTPException(status_code=400, detail="Pattern already favorited")
     
     # Add to favorites
     favorite = FavoritePattern(user_id=user_id, pattern_id=pattern_id)
     db.add(favorite)
     db.commit()
-    db.close()
     
     return {"message": "Pattern added to favorites"}
 
 @app.delete("/users/{user_id}/favorites/{pattern_id}/")
-def remove_favorite(user_id: int, pattern_id: int):
-    db = SessionLocal()
-    
+def remove_favorite(user_id: int, pattern_id: int, db: Session = Depends(get_db)):
     # Check if user exists
-    user = db.query(User).filter(User.user_id == user_id).first()
-    if not user:
-        db.close()
-        raise HTTPException(status_code=404, detail="User not found")
+    require_user(db, user_id)
     
     # Check if pattern exists
-    pattern = db.query(Pattern).filter(Pattern.pattern_id == pattern_id).first()
-    if not pattern:
-        db.close()
+    if not row_exists(db, Pattern.pattern_id == pattern_id):
         raise HTTPException(status_code=404, detail="Pattern not found")
     
     # Check if favorited
@@ -2348,13 +2498,11 @@ def remove_favorite(user_id: int, pattern_id: int):
         FavoritePattern.pattern_id == pattern_id
     ).first()
     if not favorite:
-        db.close()
         raise HTTPException(status_code=404, detail="Pattern not in favorites")
     
     # Remove from favorites
     db.delete(favorite)
     db.commit()
-    db.close()
     
     return {"message": "Pattern removed from favorites"}
 
@@ -2363,7 +2511,8 @@ def remove_favorite(user_id: int, pattern_id: int):
 def get_user_favorites(
     user_id: int,
     page: int = 1,
-    page_size: int = 30
+    page_size: int = 30,
+    db: Session = Depends(get_db)
 ):
     # Validate pagination parameters
     if page < 1:
@@ -2373,91 +2522,45 @@ def get_user_favorites(
     if page_size > 100000:
         page_size = 100000
     
-    db = SessionLocal()
-    
     # Check if user exists
-    user = db.query(User).filter(User.user_id == user_id).first()
-    if not user:
-        db.close()
-        raise HTTPException(status_code=404, detail="User not found")
+    require_user(db, user_id)
     
     # Get favorited patterns
-    favorites_query = db.query(Pattern).join(FavoritePattern).filter(
+    favorites_query = db.query(Pattern.pattern_id).join(FavoritePattern).filter(
         FavoritePattern.user_id == user_id
-    )
+    ).order_by(Pattern.pattern_id)
     
     # Count total
-    total_count = favorites_query.count()
+    total_count = favorites_query.order_by(None).count()
     
     # Apply pagination
-    result = favorites_query.offset((page - 1) * page_size).limit(page_size).all()
+    page_ids = [row.pattern_id for row in favorites_query.offset((page - 1) * page_size).limit(page_size).all()]
     
-    # Build response with related data
+    # Build response with related data, in one query for the whole page
+    rows_by_id = {
+        row.pattern_id: row
+        for row in pattern_listing_query(db).filter(Pattern.pattern_id.in_(page_ids)).all()
+    }
     patterns_response = []
-    for pattern in result:
-        # Get craft type
-        craft_type_result = db.query(CraftType.name).join(RequiresCraftType).filter(
-            RequiresCraftType.pattern_id == pattern.pattern_id
-        ).first()
-        craft_type_name = craft_type_result[0] if craft_type_result else None
-        
-        # Get project type
-        project_type_result = db.query(ProjectType.name).join(SuitableFor).filter(
-            SuitableFor.pattern_id == pattern.pattern_id
-        ).first()
-        project_type_name = project_type_result[0] if project_type_result else None
-        
-        # Get yarn info
-        yarn_result = db.query(YarnType.weight, PatternSuggestsYarn.yardage_min, PatternSuggestsYarn.yardage_max).join(PatternSuggestsYarn).filter(
-            PatternSuggestsYarn.pattern_id == pattern.pattern_id
-        ).first()
-        
-        pattern_weight = None
-        yardage_min = None
-        yardage_max = None
-        if yarn_result:
-            pattern_weight = yarn_result[0].lower() if yarn_result[0] else None
-            yardage_min = yarn_result[1]
-            yardage_max = yarn_result[2]
-        
-        # Get pattern link and price
-        link_result = db.query(HasLink_Link.url, HasLink_Link.price).filter(
-            HasLink_Link.pattern_id == pattern.pattern_id
-        ).first()
-        
-        if link_result:
-            pattern_url = link_result[0]
-            price_value = link_result[1]
-            if price_value is not None:
-                if price_value.lower() == 'free' or price_value == '0' or price_value == '0.0':
-                    price_display = "Free"
-                else:
-                    price_display = price_value
-            else:
-                price_display = None
-        else:
-            pattern_url = None
-            price_display = None
-        
-        patterns_response.append(PatternResponse(
-            pattern_id=pattern.pattern_id,
-            name=pattern.name,
-            designer=pattern.designer,
-            image=pattern.image if pattern.image is not None else "/placeholder.svg",
-            google_drive_file_id=pattern.google_drive_file_id,
-            yardage_min=yardage_min,
-            yardage_max=yardage_max,
+    for pattern_id in page_ids:
+        row = rows_by_id[pattern_id]
+        patterns_response.append(PatternResponse.model_construct(
+            pattern_id=row.pattern_id,
+            name=row.name,
+            designer=row.designer,
+            image=row.image if row.image is not None else "/placeholder.svg",
+            google_drive_file_id=row.google_drive_file_id,
+            yardage_min=row.yardage_min,
+            yardage_max=row.yardage_max,
             grams_min=None,
             grams_max=None,
-            project_type=project_type_name,
-            craft_type=craft_type_name,
-            required_weight=pattern_weight,
-            pattern_url=pattern_url,
-            price=price_display
+            project_type=row.project_type,
+            craft_type=row.craft_type,
+            required_weight=row.required_weight.lower() if row.required_weight else None,
+            pattern_url=row.pattern_url,
+            price=format_link_price(row.price)
         ))
     
-    db.close()
-    
     # Calculate pagination info
     total_pages = (total_count + page_size - 1) // page_size
     
@@ -2474,114 +2577,47 @@ def get_user_favorites(
     )
 
 @app.get("/users/{user_id}/favorites/{pattern_id}/check/")
-def check_favorite(user_id: int, pattern_id: int):
-    db = SessionLocal()
-    
+def check_favorite(user_id: int, pattern_id: int, db: Session = Depends(get_db)):
     # Check if user exists
-    user = db.query(User).filter(User.user_id == user_id).first()
-    if not user:
-        db.close()
-        raise HTTPException(status_code=404, detail="User not found")
+    require_user(db, user_id)
     
     # Check if pattern exists
-    pattern = db.query(Pattern).filter(Pattern.pattern_id == pattern_id).first()
-    if not pattern:
-        db.close()
+    if not row_exists(db, Pattern.pattern_id == pattern_id):
         raise HTTPException(status_code=404, detail="Pattern not found")
     
     # Check if favorited
-    favorite = db.query(FavoritePattern).filter(
+    is_favorited = row_exists(
+        db,
         FavoritePattern.user_id == user_id,
         FavoritePattern.pattern_id == pattern_id
-    ).first()
-    
-    db.close()
+    )
     
-    return {"is_favorited": favorite is not None}
+    return {"is_favorited": is_favorited}
 
 @app.get("/patterns/random", response_model=List[PatternResponse])
 @app.get("/patterns/random/", response_model=List[PatternResponse])
-def get_random_patterns():
-    db = SessionLocal()
+def get_random_patterns(db: Session = Depends(get_db)):
     try:
-        all_patterns = db.query(Pattern).all()
-        if len(all_patterns) <= 3:
-            selected_patterns = all_patterns
+        # Pick from the ids alone, then load just the picked patterns in one query
+        all_pattern_ids = db.scalars(select(Pattern.pattern_id)).all()
+        if len(all_pattern_ids) <= 3:
+            selected_ids = all_pattern_ids
         else:
-            selected_patterns = random.sample(all_patterns, 3)
-        result = []
-        for pattern in selected_patterns:
-            # Get craft type
-            craft_type_result = db.query(CraftType.name).join(RequiresCraftType).filter(
-                RequiresCraftType.pattern_id == pattern.pattern_id
-            ).first()
-            craft_type_name = craft_type_result[0] if craft_type_result else None
-
-            # Get project type
-            project_type_result = db.query(ProjectType.name).join(SuitableFor).filter(
-                SuitableFor.pattern_id == pattern.pattern_id
-            ).first()
-            project_type_name = project_type_result[0] if project_type_result else None
-
-            # Get yarn weight and yardage/grams from PatternSuggestsYarn
-            yarn_result = db.query(YarnType.weight, PatternSuggestsYarn.yardage_min, PatternSuggestsYarn.yardage_max, PatternSuggestsYarn.grams_min, PatternSuggestsYarn.grams_max).join(PatternSuggestsYarn).filter(
-                PatternSuggestsYarn.pattern_id == pattern.pattern_id
-            ).first()
-            yarn_weight = yarn_result[0] if yarn_result else None
-            yardage_min = yarn_result[1] if yarn_result else None
-            yardage_max = yarn_result[2] if yarn_result else None
-            grams_min = yarn_result[3] if yarn_result else None
-            grams_max = yarn_result[4] if yarn_result else None
-
-            # Get pattern link and price
-            link_result = db.query(HasLink_Link.url, HasLink_Link.price).filter(
-                HasLink_Link.pattern_id == pattern.pattern_id
-            ).first()
-            if link_result:
-                pattern_url = link_result[0]
-                price_value = link_result[1]
-                if price_value is not None:
-                    if str(price_value).lower() == 'free' or str(price_value) == '0' or str(price_value) == '0.0':
-                        price_display = "Free"
-                    else:
-                        price_display = price_value
-                else:
-                    price_display = None
-            else:
-                pattern_url = None
-                price_display = None
-
-            result.append(PatternResponse(
-                pattern_id=pattern.pattern_id,
-                name=pattern.name,
-                designer=pattern.designer,
-                image=pattern.image if pattern.image is not None else "/placeholder.svg",
-                google_drive_file_id=pattern.google_drive_file_id,
-                yardage_min=yardage_min,
-                yardage_max=yardage_max,
-                grams_min=grams_min,
-                grams_max=grams_max,
-                project_type=project_type_name,
-                craft_type=craft_type_name,
-                required_weight=yarn_weight,
-                pattern_url=pattern_url,
-                price=price_display
-            ))
-        db.close()
+            selected_ids = random.sample(all_pattern_ids, 3)
+        rows_by_id = {
+            row.pattern_id: row
+            for row in pattern_listing_query(db).filter(Pattern.pattern_id.in_(selected_ids)).all()
+        }
+        result = [pattern_response_from_row(rows_by_id[pattern_id]) for pattern_id in selected_ids]
         return result
     except Exception as e:
-        db.close()
         raise HTTPException(status_code=500, detail=f"Failed to get random patterns: {str(e)}")
 
 @app.delete("/users/{user_id}/yarn/{yarn_id}")
-def delete_user_yarn(user_id: int, yarn_id: str):
-    db = SessionLocal()
+def delete_user_yarn(user_id: int, yarn_id: str, db: Session = Depends(get_db)):
     try:
         # Check if user exists
-        user = db.query(User).filter(User.user_id == user_id).first()
-        if not user:
-            db.close()
-            raise HTTPException(status_code=404, detail="User not found")
+        require_user(db, user_id)
 
         # Check if the user owns this yarn
         owns_yarn = db.query(OwnsYarn).filter(
@@ -2589,43 +2625,33 @@ def delete_user_yarn(user_id: int, yarn_id: str):
             OwnsYarn.yarn_id == yarn_id
         ).first()
         if not owns_yarn:
-            db.close()
             raise HTTPException(status_code=404, detail="Yarn not found in user's stash")
 
         # Delete the ownership relationship
         db.delete(owns_yarn)
         db.commit()
-        db.close()
         return {"message": "Yarn removed from stash"}
     except Exception as e:
         db.rollback()
-        db.close()
         raise HTTPException(status_code=500, detail=f"Error deleting yarn: {str(e)}")
 
 # Add API endpoints for WIP
 @app.get("/users/{user_id}/wip", response_model=List[int])
-def get_user_wip(user_id: int):
-    db = SessionLocal()
+def get_user_wip(user_id: int, db: Session = Depends(get_db)):
     wip = db.query(WorkInProgress.pattern_id).filter(WorkInProgress.user_id == user_id).all()
-    db.close()
     return [row[0] for row in wip]
 
 @app.post("/users/{user_id}/wip/{pattern_id}")
-def add_wip(user_id: int, pattern_id: int):
-    db = SessionLocal()
-    exists = db.query(WorkInProgress).filter(WorkInProgress.user_id == user_id, WorkInProgress.pattern_id == pattern_id).first()
-    if not exists:
+def add_wip(user_id: int, pattern_id: int, db: Session = Depends(get_db)):
+    if not row_exists(db, WorkInProgress.user_id == user_id, WorkInProgress.pattern_id == pattern_id):
         db.add(WorkInProgress(user_id=user_id, pattern_id=pattern_id))
         db.commit()
-    db.close()
     return {"message": "Pattern marked as WIP"}
 
 @app.delete("/users/{user_id}/wip/{pattern_id}")
-def remove_wip(user_id: int, pattern_id: int):
-    db = SessionLocal()
+def remove_wip(user_id: int, pattern_id: int, db: Session = Depends(get_db)):
     db.query(WorkInProgress).filter(WorkInProgress.user_id == user_id, WorkInProgress.pattern_id == pattern_id).delete()
     db.commit()
-    db.close()
     return {"message": "Pattern removed from WIP"}
 
 # To run: uvicorn app:app --reload
\ No newline at end of file